@@ -0,0 +1,63 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from timeit import repeat
+
+import numpy as np
+
+from src.pylabzmqinterface import codec
+
+
+# 置き換え前の実装 (比較用)
+def legacy_format(npArray: np.ndarray) -> str:
+    npAsStr = ""
+    for num in npArray:
+        npAsStr += f'{num:.12f}'
+        npAsStr += "\t"
+    return npAsStr.rstrip("\t")
+
+
+def legacy_parse(arrayStr: str) -> np.ndarray:
+    list = []
+    for valStr in arrayStr.split("\t"):
+        try:
+            valNum = float(valStr)
+        except:
+            valNum = float("NaN")
+        list.append(valNum)
+    return np.array(list)
+
+
+def measure(function, argument, number: int) -> float:
+    # 1回あたりの最短時間 [us]
+    return min(repeat(lambda: function(argument), number=number, repeat=5)) / number * 1e6
+
+
+np.random.seed(1)
+
+print('%8s %14s %14s %8s %14s %14s %8s' % ('size', 'format(old)', 'format(new)', 'gain', 'parse(old)', 'parse(new)', 'gain'))
+for size in [10, 100, 10000]:
+    array = np.random.normal(size=size)
+    text = legacy_format(array)
+
+    # 置き換え前後で結果が一致することを確認
+    assert codec.format_array(array) == text
+    assert np.array_equal(codec.parse_array(text), legacy_parse(text))
+    assert np.array_equal(codec.parse_array(text + '\tgarbage'), legacy_parse(text + '\tgarbage'), equal_nan=True)
+
+    number = max(1, 100000 // size)
+    old_format, new_format = measure(legacy_format, array, number), measure(codec.format_array, array, number)
+    old_parse, new_parse = measure(legacy_parse, text, number), measure(codec.parse_array, text, number)
+    print('%8d %12.1fus %12.1fus %7.1fx %12.1fus %12.1fus %7.1fx' % (size, old_format, new_format, old_format / new_format, old_parse, new_parse, old_parse / new_parse))
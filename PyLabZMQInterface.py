@@ -13,16 +13,19 @@
 # limitations under the License.
 
 
+from argparse import ArgumentParser
 from copy import deepcopy
-import sys
-from typing import Generator, Iterable, Iterator, Tuple
+from functools import partial
+import os.path
+from typing import Generator, Iterable, Iterator, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 
 from src import OUTDIR
 from src.learner import LearnerBase
-from src.pylabzmqinterface import run
+from src.pylabzmqinterface import run, run_interleaved, run_router
+from src.pylabzmqinterface.session import MAX_REDISPATCHES
 
 
 class Learner(LearnerBase):
@@ -106,46 +109,87 @@ class Learner(LearnerBase):
         return combo_result
 
 
-def main() -> Iterator[Iterator[Generator[pd.Series, pd.Series, None]]]:
+# budget: ベイズ探索の学習の待ち時間の上限 [s] (Noneなら学習が終わるまで待つ)
+# fantasize: ベイズ探索で結果待ちの実験を予測平均値で仮置きして次の実験を選ぶ
+def campaign(seed: int, budget: Optional[float] = None, fantasize: bool = False) -> Iterator[Iterator[Generator[pd.Series, pd.Series, None]]]:
 
-    # seedを1から10まで
-    for seed in range(1, 1 + 10):
-
-        #初期状態を生成
-        initial_learner = Learner(seed)
+    #初期状態を生成
+    initial_learner = Learner(seed)
 
-        # ランダム探索を20回行う
-        yield initial_learner.random_search(
-            search_num=1,
-            num_probes=20
-        )
+    # ランダム探索を20回行う
+    yield initial_learner.random_search(
+        search_num=1,
+        num_probes=20
+    )
 
-        # 初期状態をコピー
-        learner = deepcopy(initial_learner)
+    # 初期状態をコピー
+    learner = deepcopy(initial_learner)
 
-        # 初期状態の続きからランダム探索を80回行う
-        yield learner.random_search(
-            search_num=1,
-            num_probes=80
-        )
+    # 初期状態の続きからランダム探索を80回行う
+    yield learner.random_search(
+        search_num=1,
+        num_probes=80
+    )
 
-        # 初期状態をコピー
-        learner = deepcopy(initial_learner)
+    # 初期状態をコピー
+    learner = deepcopy(initial_learner)
 
-        # 初期状態の続きからベイズ探索を80回行う
-        yield learner.bayes_search(
-            search_num=2,
-            num_probes=80,
-            num_candidates=10000,
-            score='TS',
-            interval=20,
-            num_rand_basis=5000
-        )
+    # 初期状態の続きからベイズ探索を80回行う
+    yield learner.bayes_search(
+        search_num=2,
+        num_probes=80,
+        num_candidates=10000,
+        score='TS',
+        interval=20,
+        num_rand_basis=5000,
+        budget=budget,
+        fantasize=fantasize
+    )
 
 
-if len(sys.argv) > 1:
-    binder = sys.argv[1]
-else:
-    binder = 'tcp://172.27.25.73:5555'
+def main(budget: Optional[float] = None, fantasize: bool = False) -> Iterator[Iterator[Generator[pd.Series, pd.Series, None]]]:
 
-run(binder, main())
+    # seedを1から10まで
+    for seed in range(1, 1 + 10):
+        yield from campaign(seed, budget, fantasize)
+
+
+# PyLabZMQMockClient.py --inproc から main() を使えるように、直接実行された時だけサーバーを起動する
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('binder', nargs='?', default='tcp://172.27.25.73:5555')
+    parser.add_argument('--router', action='store_true', help='シーケンサー毎に独立したmain()を実行する')
+    parser.add_argument('--interleave', action='store_true', help='seed毎のcampaign()を並行して進め、学習中も他のseedの実験を行う')
+    parser.add_argument('--publisher', help='進捗を配信するPUBソケットのアドレス (例: tcp://*:5556)')
+    parser.add_argument('--queue-depth', type=int, default=1, help='結果を待たずにシーケンサーへ渡しておく実験の数')
+    parser.add_argument('--lookahead', type=int, default=1, help='結果を待たずに学習器から先読みしておく実験パラメータの数')
+    parser.add_argument('--timeout', type=float, help='結果が返ってこない実験を諦めるまでの時間 [s] (指定しなければ待ち続ける)')
+    parser.add_argument('--on-timeout', choices=['redispatch', 'nan', 'skip'], default='redispatch', help='諦めた実験の扱い (redispatch: 再送する, nan: 結果をNaNとする, skip: 破棄する)')
+    parser.add_argument('--max-redispatches', type=int, default=MAX_REDISPATCHES, help='--on-timeout redispatchで同じ実験を再送する最大回数 (超えたら破棄する)')
+    parser.add_argument('--metrics-interval', type=float, help='計測値をOUTDIR/metrics.tsvに書き出す間隔 [s] (指定しなくても終了時とdumpMetrics()で書き出す)')
+    parser.add_argument('--budget', type=float, help='ベイズ探索の学習をこの時間 [s] 以上待たず、終わっていなければ前回の学習結果で次の実験を選ぶ (実験の順序は再現できない)')
+    parser.add_argument('--fantasize', action='store_true', help='ベイズ探索で結果待ちの実験を予測平均値で仮置きして次の実験を選ぶ (--queue-depthが2以上の時に有効)')
+    parser.add_argument('--journal', help='実験の記録ファイル (既にあれば、その続きから再開する)')
+    parser.add_argument('--record', action='store_true', help='シーケンサーとの通信をOUTDIR/protocol.recに記録する (PyLabZMQReplay.pyで再生できる)')
+    args = parser.parse_args()
+
+    # 学習の待ち時間で実験が変わるので、記録から再開できない
+    if args.budget is not None and args.journal:
+        parser.error('--journal cannot be used with --budget')
+
+    if args.router:
+        # 複数のシーケンサーの通信は1つのログに記録できない
+        if args.record or args.journal:
+            parser.error('--record and --journal cannot be used with --router')
+        if args.interleave:
+            parser.error('--interleave cannot be used with --router')
+        # シーケンサー毎に別プロセスで学習し (乱数を共有しない)、結果はOUTDIR/<シーケンサーのZMQ identity>に保存する
+        run_router(args.binder, partial(main, args.budget, args.fantasize), OUTDIR, publisher=args.publisher, queue_depth=args.queue_depth, metrics_dir=OUTDIR, metrics_interval=args.metrics_interval, lookahead=args.lookahead, timeout=args.timeout, on_timeout=args.on_timeout, max_redispatches=args.max_redispatches)
+    elif args.interleave:
+        # campaign()毎に別プロセスで学習し (乱数を共有しない)、結果はOUTDIR/campaign1, campaign2, ...に保存する
+        # 複数のcampaign()の実験の順序は再現できないので、記録から再開できない
+        if args.journal:
+            parser.error('--journal cannot be used with --interleave')
+        run_interleaved(args.binder, [partial(campaign, seed, args.budget, args.fantasize) for seed in range(1, 1 + 10)], OUTDIR, publisher=args.publisher, queue_depth=args.queue_depth, record=os.path.join(OUTDIR, 'protocol.rec') if args.record else None, metrics_dir=OUTDIR, metrics_interval=args.metrics_interval, lookahead=args.lookahead, timeout=args.timeout, on_timeout=args.on_timeout, max_redispatches=args.max_redispatches)
+    else:
+        run(args.binder, main(args.budget, args.fantasize), publisher=args.publisher, queue_depth=args.queue_depth, record=os.path.join(OUTDIR, 'protocol.rec') if args.record else None, metrics_dir=OUTDIR, metrics_interval=args.metrics_interval, journal=args.journal, lookahead=args.lookahead, timeout=args.timeout, on_timeout=args.on_timeout, max_redispatches=args.max_redispatches)
@@ -0,0 +1,148 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from argparse import ArgumentParser
+import asyncio
+import os
+import os.path
+from subprocess import Popen
+import sys
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.stats
+
+from src import OUTDIR
+from src.pylabzmqmockclient.asyncclient import AsyncPyLabClient, Throughput
+from src.pylabzmqmockclient.experiment import Experiment
+
+
+# サーバーへ送る実験パラメータのヘッダー
+param_header = [
+    'Labview Param T',
+    'Labview Param 1',
+    'Labview Param 2',
+    'Labview Param 3',
+]
+
+# サーバーへ送る実験結果のヘッダー
+result_header = [
+    'Labview Result'
+]
+
+
+def simulate(param: pd.Series) -> pd.Series:
+    r = np.linalg.norm(param.values)
+    return pd.Series([scipy.stats.norm().pdf(r)], index=result_header)
+
+
+def create_experiment(experiment_time: float):
+    experiment = Experiment(pd.Index(param_header), pd.Index(result_header), simulate, 0)
+
+    # 実験時間だけ待ってから結果を返す (待っている間も他のクライアントは動く)
+    async def run(param: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        await asyncio.sleep(experiment_time)
+        return experiment(param)
+
+    return run
+
+
+def start_servers(binders: List[str], args) -> List[Popen]:
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'PyLabZMQInterface.py')
+    options = ['--queue-depth', str(args.queue_depth)]
+    if args.router:
+        binders = binders[:1]
+        options.append('--router')
+    servers = []
+    for i, binder in enumerate(binders):
+        # 履歴ファイルが混ざらないよう、サーバー毎に別のディレクトリで実行する
+        cwd = os.path.join(OUTDIR, f'server{i}')
+        os.makedirs(cwd, exist_ok=True)
+        servers.append(Popen([sys.executable, script, binder, *options], cwd=cwd))
+    return servers
+
+
+async def run_clients(binders: List[str], args) -> List[Throughput]:
+    clients = [AsyncPyLabClient(binder, param_header, result_header, long_poll_timeout=args.long_poll_timeout) for binder in binders]
+    if args.queue_depth > 1:
+        tasks = [asyncio.ensure_future(client.run_pipelined(create_experiment(args.experiment_time), args.queue_depth)) for client in clients]
+    else:
+        tasks = [asyncio.ensure_future(client.run(create_experiment(args.experiment_time))) for client in clients]
+
+    # 指定した時間だけ負荷をかける
+    await asyncio.wait(tasks, timeout=args.duration)
+    for task in tasks:
+        if task.done():
+            task.result()
+        task.cancel()
+    return [client.throughput for client in clients]
+
+
+# 実験が一つも終わらなかったクライアントはNaNとする
+def percentile_ms(latencies: np.ndarray, q: float) -> float:
+    return np.percentile(latencies, q) * 1e3 if len(latencies) > 0 else np.nan
+
+
+def summarize(throughputs: List[Throughput]) -> pd.DataFrame:
+    rows = []
+    for throughput in throughputs:
+        latencies = np.array(throughput.latencies)
+        rows.append([
+            throughput.num_experiments,
+            throughput.rate,
+            percentile_ms(latencies, 50),
+            percentile_ms(latencies, 99),
+            # 学習器を待っている割合 (学習器が動いている) と実験をしている割合 (学習器が待っている)
+            throughput.waiting_time / throughput.elapsed,
+            throughput.experiment_time / throughput.elapsed,
+        ])
+    table = pd.DataFrame(rows, columns=['experiments', 'experiments/s', 'p50 [ms]', 'p99 [ms]', 'learner busy', 'learner idle'])
+    latencies = np.array([latency for throughput in throughputs for latency in throughput.latencies])
+    table.loc['total'] = [
+        table['experiments'].sum(),
+        table['experiments/s'].sum(),
+        percentile_ms(latencies, 50),
+        percentile_ms(latencies, 99),
+        table['learner busy'].mean(),
+        table['learner idle'].mean(),
+    ]
+    return table
+
+
+parser = ArgumentParser()
+parser.add_argument('--clients', type=int, default=4, help='同時に動かすクライアント (シーケンサー) の数')
+parser.add_argument('--experiment-time', type=float, default=0.0, help='1回の実験にかかる時間 [s]')
+parser.add_argument('--duration', type=float, default=60.0, help='負荷をかける時間 [s]')
+parser.add_argument('--port', type=int, default=5555, help='最初のサーバーのポート (以降1ずつ増やす)')
+parser.add_argument('--router', action='store_true', help='1つのサーバープロセス (--router) に全クライアントを接続する')
+parser.add_argument('--queue-depth', type=int, default=1, help='結果を待たずにシーケンサーへ渡しておく実験の数')
+parser.add_argument('--long-poll-timeout', type=float, default=1.0)
+args = parser.parse_args()
+
+if args.router:
+    binders = [f'tcp://127.0.0.1:{args.port}'] * args.clients
+else:
+    binders = [f'tcp://127.0.0.1:{args.port + i}' for i in range(args.clients)]
+
+servers = start_servers(binders, args)
+try:
+    table = summarize(asyncio.run(run_clients(binders, args)))
+finally:
+    for server in servers:
+        server.terminate()
+
+table.to_csv(os.path.join(OUTDIR, 'load.tsv'), sep='\t')
+print(table.to_string())
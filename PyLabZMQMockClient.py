@@ -13,8 +13,10 @@
 # limitations under the License.
 
 
+from argparse import ArgumentParser
 import os.path
 from subprocess import Popen
+from threading import Thread
 from typing import Callable
 
 import numpy as np
@@ -24,27 +26,47 @@ import scipy.stats
 from src.pylabzmqmockclient import run
 
 
+# 実験のノイズは専用の乱数で生成する (--inprocでは学習器とプロセスを共有するので、np.randomを使うと学習器の乱数列が変わる)
+noise = np.random.RandomState(1)
+
+
 def experiment(param: pd.Series) -> pd.Series:
     r = np.linalg.norm(param.values)
-    return pd.Series([scipy.stats.norm().pdf(r) + 0.0 * scipy.stats.norm().rvs()], index=result_header)
+    return pd.Series([scipy.stats.norm().pdf(r) + 0.0 * scipy.stats.norm().rvs(random_state=noise)], index=result_header)
+
+
+parser = ArgumentParser()
+parser.add_argument('--inproc', action='store_true', help='サーバーを同じプロセスで実行し、TCPを使わずに通信する')
+args = parser.parse_args()
+
+np.random.seed(1)
+
+# サーバーへ送る実験パラメータのヘッダー
+param_header = [
+    'Labview Param T',
+    'Labview Param 1',
+    'Labview Param 2',
+    'Labview Param 3',
+]
 
+# サーバーへ送る実験結果のヘッダー
+result_header = [
+    'Labview Result'
+]
 
-with Popen(['python', 'PyLabZMQInterface.py', 'tcp://127.0.0.1:5555']):
+if args.inproc:
+    from PyLabZMQInterface import main
+    from src.pylabzmqinterface import run as run_server
 
-    np.random.seed(1)
+    # クライアントは別スレッドで実行し、学習が終わったらプロセスごと終了する
+    # 待ち時間を挟まないよう、結果の送信と次のパラメータの受信を1往復で行う
+    Thread(target=run, args=('inproc://pylabzmq', param_header, result_header, experiment, 2), kwargs={'long_poll_timeout': 1.0, 'exchange': True}, daemon=True).start()
 
-    # サーバーへ送る実験パラメータのヘッダー
-    param_header = [
-        'Labview Param T',
-        'Labview Param 1',
-        'Labview Param 2',
-        'Labview Param 3',
-    ]
+    # サーバーを実行
+    run_server('inproc://pylabzmq', main())
 
-    # サーバーへ送る実験結果のヘッダー
-    result_header = [
-        'Labview Result'
-    ]
+else:
+    with Popen(['python', 'PyLabZMQInterface.py', 'tcp://127.0.0.1:5555']):
 
-    # クライアントを実行
-    run('tcp://127.0.0.1:5555', param_header, result_header, experiment, 2)
+        # クライアントを実行
+        run('tcp://127.0.0.1:5555', param_header, result_header, experiment, 2)
@@ -0,0 +1,54 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from argparse import ArgumentParser
+import os.path
+from subprocess import Popen
+
+from src import OUTDIR
+from src.pylabzmqinterface.recorder import read_options, replay
+
+
+parser = ArgumentParser()
+parser.add_argument('log', help='PyLabZMQInterface.py --record で記録したprotocol.rec')
+parser.add_argument('--binder', default='tcp://127.0.0.1:5555')
+parser.add_argument('--realtime', action='store_true', help='記録時のシーケンサーの待ち時間を再現する (指定しなければ最速で再生する)')
+args = parser.parse_args()
+
+# --interleaveでは、どのcampaign()の実験を渡すかがタイミングで決まるので、記録と同じ順序で再生できない
+recorded_options = read_options(args.log)
+if recorded_options.get('interleave'):
+    parser.error('logs recorded with --interleave cannot be replayed')
+
+# 記録時のサーバーオプション (キューの深さ、先読み数、タイムアウトなど) をコマンドライン引数に戻す
+options = []
+for name, value in recorded_options.items():
+    if value is None or value is False:
+        continue
+    options.append('--' + name.replace('_', '-'))
+    if value is not True:
+        options.append(str(value))
+
+# 記録時と同じmain()を同じオプションで実行する新しいサーバーに、記録したリクエストを順に送る
+# (結果はパラメータで照合されるので、記録時と同じシードで学習すること)
+with Popen(['python', 'PyLabZMQInterface.py', args.binder, *options]) as server:
+    try:
+        latencies = replay(args.binder, args.log, realtime=args.realtime)
+    finally:
+        server.terminate()
+
+latencies.to_csv(os.path.join(OUTDIR, 'replay.tsv'), sep='\t', index=False)
+print(latencies.groupby('command')[['recorded_latency', 'replayed_latency']].describe(percentiles=[0.5, 0.99]).T)
+print(latencies[['recorded_latency', 'replayed_latency']].sum())
@@ -25,12 +25,16 @@ from src.common.logging import Formatter, captureStderr, captureStdout, getStder
 import src.notebook
 from src import pylabzmqinterface
 from src import pylabzmqmockclient
+from src.pylabzmqinterface.learnerprocess import OUTDIR_ENV
 
 
 OUTDIR: str
 
 
 def _get_outdir(name: str) -> str:
+    # a learner process writes to the directory given by its parent
+    if OUTDIR_ENV in os.environ:
+        return os.environ[OUTDIR_ENV]
     titlename, _ = os.path.splitext(os.path.basename(name))
     return os.path.abspath(os.path.join(os.getcwd(), titlename, f"{datetime.now():%Y-%m-%d_%H-%M-%S}"))
 
@@ -13,7 +13,9 @@
 # limitations under the License.
 
 
-from typing import Callable, Optional
+from copy import deepcopy
+from itertools import count
+from typing import Callable, Dict, Optional, Tuple
 
 import combo
 import numpy as np
@@ -63,6 +65,10 @@ class Predictor:
         self.training = combo.variable(X=self.centering(training.X), t=training.t)
         self._predictor = init_predictor(num_rand_basis=num_rand_basis, config=config)
         learn(self.predictor, self.training, num_rand_basis=num_rand_basis)
+        # pending points believed to take their predicted mean until their result is written
+        self._fantasies: Dict[int, combo.variable] = {}
+        self._fantasy_keys = count()
+        self._believing: Optional[Tuple[combo.base_predictor, combo.variable]] = None
 
     @property
     def predictor(self) -> combo.base_predictor:
@@ -74,6 +80,18 @@ class Predictor:
 
     def write(self, test:combo.variable, t: np.ndarray) -> None:
         self.new_data.add(X=test.X, t=t, Z=test.Z)
+        self._believing = None
+
+    def believe(self, test: combo.variable) -> int:
+        predictor, training = self._believe()
+        key = next(self._fantasy_keys)
+        self._fantasies[key] = combo.variable(X=test.X, t=predictor.get_post_fmean(training, test), Z=test.Z)
+        self._believing = None
+        return key
+
+    def forget(self, key: int) -> None:
+        if self._fantasies.pop(key, None) is not None:
+            self._believing = None
 
     def get_score(self, score: str) -> Callable[[np.ndarray], combo.variable]:
         if score == 'EI':
@@ -86,4 +104,20 @@ class Predictor:
             raise NotImplementedError('mode must be EI, PI or TS.')
 
     def _init_score(self, mode: Callable[[combo.base_predictor, combo.variable], Callable[[combo.variable], np.ndarray]]) -> Callable[[np.ndarray], combo.variable]:
-        return ScoreState(self.predictor, self.centering, mode(self.predictor, self.training))
+        predictor, training = self._believe()
+        return ScoreState(predictor, self.centering, mode(predictor, training))
+
+    def _believe(self) -> Tuple[combo.base_predictor, combo.variable]:
+        predictor = self.predictor
+        if not self._fantasies:
+            return predictor, self.training
+        if self._believing is None:
+            fantasies = combo.variable()
+            for fantasy in self._fantasies.values():
+                fantasies.add(X=fantasy.X, t=fantasy.t, Z=fantasy.Z)
+            predictor = deepcopy(predictor)
+            update(predictor, fantasies)
+            training = combo.variable(X=self.training.X, t=self.training.t, Z=self.training.Z)
+            training.add(X=fantasies.X, t=fantasies.t, Z=fantasies.Z)
+            self._believing = (predictor, training)
+        return self._believing
@@ -14,7 +14,9 @@
 
 
 from abc import ABC, abstractmethod
-from collections import OrderedDict
+from collections import OrderedDict, deque
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
 from copy import copy, deepcopy
 from enum import IntEnum
 from itertools import count, islice, repeat, tee
@@ -22,7 +24,8 @@ import os
 from os import PathLike
 import os.path
 import sys
-from typing import Any, Callable, Dict, Generator, IO, Iterable, Iterator, List, MutableMapping, Optional, Tuple, TypeVar, Union, overload
+import time
+from typing import Any, Callable, Deque, Dict, Generator, IO, Iterable, Iterator, List, MutableMapping, Optional, Tuple, TypeVar, Union, overload
 
 import numpy as np
 import pandas as pd
@@ -34,20 +37,38 @@ from src.common.combo.policy import Policy
 from src.common.combo.predictor import Predictor
 from src.common.genertools import Generand, from_generator, call
 from src.common.itertools import CopiableIterator
+from src.learner import history
+from src.pylabzmqinterface import progress
 
 
 class Exp:
 
-    def __init__(self, search_num: int, probe_num: int, learner_param: pd.Series) -> None:
+    def __init__(self, search_num: int, probe_num: int, learner_param: pd.Series, fallback: bool = False) -> None:
         self.search_num = search_num
         self.probe_num = probe_num
         self.duplicate_num = 0
+        self.fallback = fallback
         self.learner_param = learner_param
         self.sequencer_param: pd.Series
         self.sequencer_result: pd.Series
         self.learner_result: pd.Series
 
 
+# candidate learner parameters drawn uniformly within the limits of one probe
+class Candidates:
+
+    def __init__(self, low: pd.Series, high: pd.Series) -> None:
+        self.low = low
+        self.high = high
+
+    def __call__(self, size: int, random: Optional[np.random.RandomState] = None) -> pd.DataFrame:
+        uniform = np.random.uniform if random is None else random.uniform
+        return pd.DataFrame(uniform(self.low.values, self.high.values, (size, len(self.low))), columns=self.low.index)
+
+    def __contains__(self, learner_param: pd.Series) -> bool:
+        return bool(((self.low <= learner_param) & (learner_param <= self.high)).all())
+
+
 class LearnerBase(ABC):
 
     def __init__(self, seed: int) -> None:
@@ -63,20 +84,25 @@ class LearnerBase(ABC):
     def random_search(self, search_num: int, num_probes: int) -> Iterator[Generator[pd.Series, pd.Series, None]]:
         yield from self.__search(search_num, num_probes, random_search)
 
-    def bayes_search(self, search_num: int, num_probes: int, num_candidates: int, score: 'str', interval: int, num_rand_basis: int) -> Iterator[Generator[pd.Series, pd.Series, None]]:
-        yield from self.__search(search_num, num_probes, lambda policy: bayes_search(policy, num_candidates, score, interval, num_rand_basis))
-
-    def __search(self, search_num: int, num_probes: int, get_search: Callable[[Policy], Iterator[Callable[[Callable[[int], pd.DataFrame]], Generator[pd.Series, pd.Series, None]]]]) -> Iterator[Generator[pd.Series, pd.Series, None]]:
-        for probe_num, limit, search in zip(self.__update_probe_num(num_probes), self.__learner_param_limits, get_search(self.policy)):
-            yield from (
-                from_generator(search(lambda size: self.__get_candicate_params(limit, size)))
-                    .map(lambda learner_param: self.__init_exp(search_num, probe_num, learner_param))
-                    .map(lambda exp: self.__save_learner_history(exp, 'history.learner.tsv'))
-                    .map(lambda exp: self.__transform_from_to_sequencer(exp))
-                    .flat_map(lambda exp: self.__duplicate_from_to_sequencer(exp))
-                    .map(lambda exp: self.__save_sequencer_history(exp, 'history.sequencer.tsv'))
-                    .map(lambda exp: self.__send_to_sequencer(exp))
-            )
+    def bayes_search(self, search_num: int, num_probes: int, num_candidates: int, score: 'str', interval: int, num_rand_basis: int, budget: Optional[float] = None, fantasize: bool = False) -> Iterator[Generator[pd.Series, pd.Series, None]]:
+        yield from self.__search(search_num, num_probes, lambda policy: bayes_search(policy, num_candidates, score, interval, num_rand_basis, budget, fantasize))
+
+    def __search(self, search_num: int, num_probes: int, get_search: Callable[[Policy], Iterator[Callable[[Candidates], Generator[pd.Series, pd.Series, None]]]]) -> Iterator[Generator[pd.Series, pd.Series, None]]:
+        try:
+            for probe_num, limit, search in zip(self.__update_probe_num(num_probes), self.__learner_param_limits, get_search(self.policy)):
+                progress.publish(progress.PROBE, probe_num)
+                yield from (
+                    from_generator(search(self.__get_candidates(limit)))
+                        .map(lambda learner_param: self.__init_exp(search_num, probe_num, learner_param, isinstance(search, Fallback)))
+                        .map(lambda exp: self.__save_learner_history(exp, 'history.learner.tsv'))
+                        .map(lambda exp: self.__transform_from_to_sequencer(exp))
+                        .flat_map(lambda exp: self.__duplicate_from_to_sequencer(exp))
+                        .map(lambda exp: self.__save_sequencer_history(exp, 'history.sequencer.tsv'))
+                        .map(lambda exp: self.__send_to_sequencer(exp))
+                )
+        finally:
+            # the history of a finished or abandoned search is complete on disk
+            history.flush()
 
     @property
     def __learner_param_limits(self) -> Iterator[Tuple[pd.Series, pd.Series]]:
@@ -92,14 +118,12 @@ class LearnerBase(ABC):
             else:
                 break
 
-    def __get_candicate_params(self, limit: Tuple[pd.Series, pd.Series], size: int) -> pd.DataFrame:
+    def __get_candidates(self, limit: Tuple[pd.Series, pd.Series]) -> Candidates:
         low, high = limit
-        low = low[self.combo_param_header]
-        high = high[self.combo_param_header]
-        return pd.DataFrame(np.random.uniform(low.values, high.values, (size, *self.combo_param_header.shape)), columns=self.combo_param_header)
+        return Candidates(low[self.combo_param_header], high[self.combo_param_header])
 
-    def __init_exp(self, search_num: int, probe_num: int, learner_param: pd.Series) -> Generator[Exp, Exp, pd.Series]:
-        exp = (yield Exp(search_num, probe_num, learner_param))
+    def __init_exp(self, search_num: int, probe_num: int, learner_param: pd.Series, fallback: bool) -> Generator[Exp, Exp, pd.Series]:
+        exp = (yield Exp(search_num, probe_num, learner_param, fallback))
         return exp.learner_result
 
     def __transform_from_to_sequencer(self, exp: Exp) -> Generator[Exp, Exp, Exp]:
@@ -135,6 +159,7 @@ class LearnerBase(ABC):
                 self.seed,
                 exp.search_num,
                 exp.probe_num,
+                int(exp.fallback),
                 *exp.learner_param,
                 *exp.learner_result
             ],
@@ -143,6 +168,7 @@ class LearnerBase(ABC):
                 'seed',
                 'search_num',
                 'probe_num',
+                'fallback',
                 *exp.learner_param.index,
                 *exp.learner_result.index
             ],
@@ -160,6 +186,7 @@ class LearnerBase(ABC):
                 exp.search_num,
                 exp.probe_num,
                 exp.duplicate_num,
+                int(exp.fallback),
                 *exp.sequencer_param,
                 *exp.sequencer_result
             ],
@@ -169,6 +196,7 @@ class LearnerBase(ABC):
                 'search_num',
                 'probe_num',
                 'duplicate_num',
+                'fallback',
                 *exp.sequencer_param.index,
                 *exp.sequencer_result.index
             ],
@@ -178,12 +206,7 @@ class LearnerBase(ABC):
         return exp
 
     def __save_history(self, record: pd.Series, outname: str) -> None:
-        table = pd.DataFrame([record], dtype=object)
-        outpath = os.path.join(OUTDIR, outname)
-        if os.path.exists(outpath):
-            table.to_csv(outpath, sep='\t', header=False, index=False, mode='a')
-        else:
-            table.to_csv(outpath, sep='\t', header=True, index=False, mode='w')
+        history.write(os.path.join(OUTDIR, outname), record)
 
     def __send_to_sequencer(self, exp: Exp) -> Generator[pd.Series, pd.Series, Exp]:
         param = pd.Series(
@@ -240,29 +263,92 @@ class LearnerBase(ABC):
         ...
 
 
-def random_search(policy: Policy) -> Iterator[Callable[[Callable[[int], pd.DataFrame]], Generator[pd.Series, pd.Series, None]]]:
-    def probe(get_candidate_params: Callable[[int], pd.DataFrame]) -> Generator[pd.Series, pd.Series, None]:
+def _publish_best(policy: Policy) -> None:
+    num_search = policy.history.total_num_search
+    progress.publish(progress.BEST, num_search, np.max(policy.history.fx[:num_search]))
+
+
+def random_search(policy: Policy) -> Iterator[Callable[[Candidates], Generator[pd.Series, pd.Series, None]]]:
+    def probe(get_candidate_params: Candidates) -> Generator[pd.Series, pd.Series, None]:
         X = get_candidate_params(1)
         best_X = X.iloc[0]
         t = (yield best_X)
         policy.write(np.array([best_X.values]), np.array([t.item()]))
+        _publish_best(policy)
     while True:
         yield probe
 
 
-def bayes_search(policy: Policy, num_candidates: int, score: 'str', interval: int, num_rand_basis: int) -> Iterator[Callable[[Callable[[int], pd.DataFrame]], Generator[pd.Series, pd.Series, None]]]:
+# probe proposed while the predictor was still being fitted; flagged in the history files
+class Fallback:
+
+    def __init__(self, probe: Callable[[Candidates], Generator[pd.Series, pd.Series, None]]) -> None:
+        self.probe = probe
+
+    def __call__(self, get_candidate: Candidates) -> Generator[pd.Series, pd.Series, None]:
+        return self.probe(get_candidate)
 
-    def probe(predictor: Predictor, get_candidate: Callable[[int], pd.DataFrame]) -> Generator[pd.Series, pd.Series, None]:
+
+def bayes_search(policy: Policy, num_candidates: int, score: 'str', interval: int, num_rand_basis: int, budget: Optional[float] = None, fantasize: bool = False) -> Iterator[Callable[[Candidates], Generator[pd.Series, pd.Series, None]]]:
+
+    # candidates of the last scoring pass after the probed one, best first
+    ranked_X: Deque[pd.Series] = deque()
+
+    def probe(predictor: Predictor, get_candidate: Candidates) -> Generator[pd.Series, pd.Series, None]:
         get_score = predictor.get_score(score)
         X = get_candidate(num_candidates)
         test = get_score(X.values)
         action = np.argmax(test.t, axis=0)
         best_X = X.iloc[action, :]
-        t = (yield best_X)
+        ranked_X.clear()
+        ranked_X.extend(X.iloc[i, :] for i in np.argsort(-test.t, axis=0)[1:1 + interval])
+        # with fantasize, the next probes see this one at its predicted mean while its result is pending
+        fantasy = predictor.believe(test.get_subset([action])) if fantasize else None
+        try:
+            t = (yield best_X)
+        finally:
+            # also when the probe is abandoned or its result never comes
+            if fantasy is not None:
+                predictor.forget(fantasy)
         policy.write(np.array([best_X.values]), np.array([t.item()]))
         predictor.write(test.get_subset([action]), np.array([t.item()]))
-
-    while True:
-        predictor = policy.learn(num_rand_basis=num_rand_basis)
-        for _ in range(interval):
-            yield lambda get_candidate: probe(predictor, get_candidate)
+        _publish_best(policy)
+
+    # best unused candidate of the last scoring pass still within the current limits, or a
+    # random point in them
+    def fallback_probe(get_candidate: Candidates) -> Generator[pd.Series, pd.Series, None]:
+        while ranked_X and ranked_X[0] not in get_candidate:
+            ranked_X.popleft()
+        best_X = ranked_X.popleft() if ranked_X else get_candidate(1, fallback_random).iloc[0]
+        t = (yield best_X)
+        policy.write(np.array([best_X.values]), np.array([t.item()]))
+        _publish_best(policy)
+
+    # with a budget, fit on a snapshot of the training data in another thread and propose a
+    # fallback whenever the fit is not done within budget seconds of being asked for a probe.
+    # The fit draws from the global np.random, so the fallbacks draw from their own stream to
+    # keep the sequence of fits reproducible; which probes become fallbacks still depends on
+    # how long the fits take, so a budgeted search is not reproducible from its seed and its
+    # journal cannot be replayed
+    executor = None if budget is None else ThreadPoolExecutor(max_workers=1)
+    fallback_random = None if budget is None else np.random.RandomState(np.random.randint(2 ** 31))
+    try:
+        while True:
+            progress.publish(progress.REFIT_START, policy.history.total_num_search)
+            start = time.perf_counter()
+            if executor is None:
+                predictor = policy.learn(num_rand_basis=num_rand_basis)
+            else:
+                future = executor.submit(Predictor, copy(policy.training), num_rand_basis)
+                while True:
+                    try:
+                        predictor = future.result(timeout=budget)
+                        break
+                    except concurrent.futures.TimeoutError:
+                        yield Fallback(fallback_probe)
+            progress.publish(progress.REFIT_END, policy.history.total_num_search, time.perf_counter() - start)
+            for _ in range(interval):
+                yield lambda get_candidate: probe(predictor, get_candidate)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -0,0 +1,120 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Buffered writer of the history files.
+#
+# Records are kept in memory per file and appended in one to_csv call every
+# max_rows records, every interval seconds, at the end of each search and at
+# exit. Consecutive records with the same columns are written as one table,
+# and a file gets its header when it does not exist yet, so the files are
+# the same as when every record is appended on its own.
+
+
+import atexit
+import os.path
+from threading import Lock, Thread
+import time
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+
+MAX_ROWS = 100
+INTERVAL = 1.0
+
+
+class HistoryWriter:
+
+    def __init__(self, path: str, max_rows: int = MAX_ROWS) -> None:
+        super().__init__()
+        self.path = path
+        self.max_rows = max_rows
+        self._records: List[pd.Series] = []
+        # written by the learner threads, flushed also by the periodic thread and at exit
+        self._lock = Lock()
+
+    def write(self, record: pd.Series) -> None:
+        with self._lock:
+            self._records.append(record)
+            if len(self._records) >= self.max_rows:
+                self._flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        records, self._records = self._records, []
+        start = 0
+        for end in range(1, 1 + len(records)):
+            if end == len(records) or not records[end].index.equals(records[start].index):
+                table = pd.DataFrame([record.values for record in records[start:end]], columns=records[start].index, dtype=object)
+                if os.path.exists(self.path):
+                    table.to_csv(self.path, sep='\t', header=False, index=False, mode='a')
+                else:
+                    table.to_csv(self.path, sep='\t', header=True, index=False, mode='w')
+                start = end
+
+
+_writers: Dict[str, HistoryWriter] = {}
+
+_lock = Lock()
+
+_max_rows = MAX_ROWS
+
+_interval: Optional[float] = INTERVAL
+
+_thread: Optional[Thread] = None
+
+
+# max_rows=1 and interval=None write every record at once
+def configure(max_rows: int = MAX_ROWS, interval: Optional[float] = INTERVAL) -> None:
+    global _max_rows, _interval
+    _max_rows = max_rows
+    _interval = interval
+    with _lock:
+        for writer in _writers.values():
+            writer.max_rows = max_rows
+
+
+def write(path: str, record: pd.Series) -> None:
+    global _thread
+    with _lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = _writers[path] = HistoryWriter(path, _max_rows)
+        if _thread is None and _interval is not None:
+            _thread = Thread(target=_flush_periodically, daemon=True)
+            _thread.start()
+    writer.write(record)
+
+
+def flush() -> None:
+    with _lock:
+        writers = [*_writers.values()]
+    for writer in writers:
+        writer.flush()
+
+
+def _flush_periodically() -> None:
+    global _thread
+    while _interval is not None:
+        time.sleep(_interval)
+        flush()
+    with _lock:
+        _thread = None
+
+
+atexit.register(flush)
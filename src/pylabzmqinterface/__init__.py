@@ -13,15 +13,96 @@
 # limitations under the License.
 
 
-from typing import Any, Generator, Iterator
+import os.path
+from typing import Any, Callable, Generator, Iterable, Iterator, Optional, Sequence
 
+import numpy as np
 import pandas as pd
 
+from src.pylabzmqinterface import metrics, progress, recorder
 from src.pylabzmqinterface.adapter import Adapter
 from src.pylabzmqinterface.connection import Connection
+from src.pylabzmqinterface.journal import Journal, read_headers
+from src.pylabzmqinterface.learnerprocess import LearnerProcess
 from src.pylabzmqinterface.pylabinterface import PyLabInterface
-from src.pylabzmqinterface.session import Session
+from src.pylabzmqinterface.pylabrouter import PyLabRouter
+from src.pylabzmqinterface.scheduler import Scheduler
+from src.pylabzmqinterface.session import MAX_REDISPATCHES, REDISPATCH, Session
+from src.pylabzmqinterface.sharedmemory import Channel, serve
 
 
-def run(binder: Any, on_connection: Iterator[Iterator[Generator[pd.Series, pd.Series, None]]]) -> None:
-    PyLabInterface.run(binder, lambda param_header, result_header, initial_param: Adapter(Connection(on_connection, lambda on_session: Session(on_session, param_header, result_header, initial_param))))
+def _create_adapter(on_connection: Iterator[Iterator[Generator[pd.Series, pd.Series, None]]], journal: Optional[str] = None, lookahead: int = 1, timeout: Optional[float] = None, on_timeout: str = REDISPATCH, max_redispatches: int = MAX_REDISPATCHES) -> Callable[[np.ndarray, np.ndarray, np.ndarray], Adapter]:
+
+    def create_adapter(param_header: np.ndarray, result_header: np.ndarray, initial_param: np.ndarray) -> Adapter:
+        connection = Connection(on_connection, lambda on_session: Session(on_session, param_header, result_header, initial_param, timeout, on_timeout, max_redispatches))
+        return Adapter(connection if journal is None else Journal(connection, journal, param_header=param_header, result_header=result_header, initial_param=initial_param), lookahead, _get_expiry_interval(timeout))
+
+    return create_adapter
+
+
+# the learner of on_connection runs in a process of its own and writes its files to outdir
+def _create_process_adapter(create_on_connection: Callable[[], Iterator[Iterator[Generator[pd.Series, pd.Series, None]]]], outdir: str, lookahead: int = 1, timeout: Optional[float] = None, on_timeout: str = REDISPATCH, max_redispatches: int = MAX_REDISPATCHES) -> Callable[[np.ndarray, np.ndarray, np.ndarray], Adapter]:
+
+    def create_adapter(param_header: np.ndarray, result_header: np.ndarray, initial_param: np.ndarray) -> Adapter:
+        return Adapter(LearnerProcess(create_on_connection, param_header, result_header, initial_param, timeout, on_timeout, max_redispatches, outdir), lookahead, _get_expiry_interval(timeout), outdir)
+
+    return create_adapter
+
+
+# every campaign learns in a process of its own and writes its files to outdir/campaign<number>
+def _create_scheduler(create_on_connections: Sequence[Callable[[], Iterator[Iterator[Generator[pd.Series, pd.Series, None]]]]], outdir: str, lookahead: int = 1, timeout: Optional[float] = None, on_timeout: str = REDISPATCH, max_redispatches: int = MAX_REDISPATCHES) -> Callable[[np.ndarray, np.ndarray, np.ndarray], Scheduler]:
+
+    def create_scheduler(param_header: np.ndarray, result_header: np.ndarray, initial_param: np.ndarray) -> Scheduler:
+        outdirs = [os.path.join(outdir, f'campaign{i}') for i in range(1, 1 + len(create_on_connections))]
+        processes = [LearnerProcess(create_on_connection, param_header, result_header, initial_param, timeout, on_timeout, max_redispatches, campaign_outdir) for create_on_connection, campaign_outdir in zip(create_on_connections, outdirs)]
+        return Scheduler(processes, param_header, lookahead, _get_expiry_interval(timeout), outdirs)
+
+    return create_scheduler
+
+
+# look for expired experiments a few times per timeout, at least every second
+def _get_expiry_interval(timeout: Optional[float]) -> Optional[float]:
+    return None if timeout is None else min(1.0, timeout / 4)
+
+
+def run(binder: Any, on_connection: Iterator[Iterator[Generator[pd.Series, pd.Series, None]]], publisher: Optional[str] = None, queue_depth: int = 1, record: Optional[str] = None, metrics_dir: Optional[str] = None, metrics_interval: Optional[float] = None, journal: Optional[str] = None, lookahead: int = 1, timeout: Optional[float] = None, on_timeout: str = REDISPATCH, max_redispatches: int = MAX_REDISPATCHES) -> None:
+    if publisher is not None:
+        progress.bind(publisher)
+    if metrics_dir is not None:
+        metrics.enable(metrics_dir, metrics_interval)
+    if record is not None:
+        recorder.open_log(record, dict(queue_depth=queue_depth, lookahead=lookahead, timeout=timeout, on_timeout=on_timeout, max_redispatches=max_redispatches))
+    # a journal with headers was left by a crash while the sequencer kept running
+    resume = None if journal is None else read_headers(journal)
+    PyLabInterface.run(binder, _create_adapter(on_connection, journal, lookahead, timeout, on_timeout, max_redispatches), queueDepth=queue_depth, resume=resume)
+
+
+def run_interleaved(binder: Any, create_on_connections: Sequence[Callable[[], Iterator[Iterator[Generator[pd.Series, pd.Series, None]]]]], outdir: str, publisher: Optional[str] = None, queue_depth: int = 1, record: Optional[str] = None, metrics_dir: Optional[str] = None, metrics_interval: Optional[float] = None, lookahead: int = 1, timeout: Optional[float] = None, on_timeout: str = REDISPATCH, max_redispatches: int = MAX_REDISPATCHES) -> None:
+    if publisher is not None:
+        progress.bind(publisher)
+    if metrics_dir is not None:
+        metrics.enable(metrics_dir, metrics_interval)
+    if record is not None:
+        recorder.open_log(record, dict(interleave=True, queue_depth=queue_depth, lookahead=lookahead, timeout=timeout, on_timeout=on_timeout, max_redispatches=max_redispatches))
+    PyLabInterface.run(binder, _create_scheduler(create_on_connections, outdir, lookahead, timeout, on_timeout, max_redispatches), queueDepth=queue_depth)
+
+
+# every sequencer gets a learner process of its own, writing to outdir/<hex of its ZMQ identity>
+def run_router(binder: Any, create_on_connection: Callable[[], Iterator[Iterator[Generator[pd.Series, pd.Series, None]]]], outdir: str, publisher: Optional[str] = None, queue_depth: int = 1, metrics_dir: Optional[str] = None, metrics_interval: Optional[float] = None, lookahead: int = 1, timeout: Optional[float] = None, on_timeout: str = REDISPATCH, max_redispatches: int = MAX_REDISPATCHES) -> None:
+    if publisher is not None:
+        progress.bind(publisher)
+    if metrics_dir is not None:
+        metrics.enable(metrics_dir, metrics_interval)
+    PyLabRouter.run(binder, lambda identity: _create_process_adapter(create_on_connection, os.path.join(outdir, identity.hex()), lookahead, timeout, on_timeout, max_redispatches), queueDepth=queue_depth)
+
+
+def run_shared_memory(name: str, on_connection: Iterator[Iterator[Generator[pd.Series, pd.Series, None]]], param_header: Iterable[str], result_header: Iterable[str], publisher: Optional[str] = None, queue_depth: int = 1, journal: Optional[str] = None, lookahead: int = 1, timeout: Optional[float] = None, on_timeout: str = REDISPATCH, max_redispatches: int = MAX_REDISPATCHES) -> None:
+    if publisher is not None:
+        progress.bind(publisher)
+    _param_header = np.array([*param_header])
+    _result_header = np.array([*result_header])
+    channel = Channel.create(name, len(_param_header), len(_result_header), capacity=max(16, queue_depth))
+    try:
+        serve(channel, _create_adapter(on_connection, journal, lookahead, timeout, on_timeout, max_redispatches)(_param_header, _result_header, np.zeros(len(_param_header))), queue_depth)
+    finally:
+        channel.release()
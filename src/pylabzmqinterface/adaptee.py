@@ -14,7 +14,7 @@
 
 
 from abc import ABC, abstractmethod
-from typing import Iterator
+from typing import Iterator, List, Optional
 
 import numpy as np
 
@@ -25,10 +25,35 @@ class Adaptee(ABC):
     def create_reader(self) -> Iterator[np.ndarray]:
         ...
 
+    # returns whether the result was of an experiment pending here
     @abstractmethod
-    def write(self, param: np.ndarray, result: np.ndarray) -> None:
+    def write(self, param: np.ndarray, result: np.ndarray) -> bool:
         ...
 
+    # the sequencer took the experiment with param at now (time.monotonic()); its timeout
+    # runs from then. Returns whether the experiment was dispatched here
+    def start(self, param: np.ndarray, now: float) -> bool:
+        return False
+
+    # expire the experiments whose deadline passed by now (time.monotonic()), or only the
+    # pending experiment with param; returns the parameters of the expired experiments
+    def expire(self, now: float, param: Optional[np.ndarray] = None) -> List[np.ndarray]:
+        return []
+
+    # no more calls will come
+    def close(self) -> None:
+        pass
+
+    # experiments dispatched and without result yet
+    @property
+    def num_pending(self) -> int:
+        return 0
+
+    # number of the session the reader is in, counted from 1 by Connection
+    @property
+    def session_num(self) -> int:
+        return 0
+
     def __init__(self) -> None:
         self._reader = self.create_reader()
 
@@ -17,11 +17,15 @@ from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 import queue
 from queue import Queue
-from typing import Any, Callable, Optional, Tuple, TypeVar, cast
+from threading import Event, Thread
+import time
+from typing import Any, Callable, List, Optional, Tuple, TypeVar, cast
 
 import numpy as np
 
+from src.pylabzmqinterface import metrics
 from src.pylabzmqinterface.adaptee import Adaptee
+from src.pylabzmqinterface.pending import Pending
 
 
 _CallableT = TypeVar('_CallableT', bound=Callable[..., Any])
@@ -42,37 +46,118 @@ def _throwable(wrapped: _CallableT) -> _CallableT:
 
 class Adapter:
 
-    def __init__(self, adaptee: Adaptee) -> None:
+    # outdir: output directory of the learner, for the idle table (see metrics)
+    # track_rig_idle: False when the caller adds rig_idle itself, by add_rig_idle()
+    def __init__(self, adaptee: Adaptee, lookahead: int = 1, expiry_interval: Optional[float] = None, outdir: Optional[str] = None, track_rig_idle: bool = True) -> None:
         super().__init__()
         self._adaptee = adaptee
-        self._next_queue: Queue[Optional[np.ndarray]] = Queue()
+        # proposals with the session that made them
+        self._next_queue: Queue[Tuple[Optional[np.ndarray], int]] = Queue()
         self._last_queue: Queue[Callable[[], bool]] = Queue()
+        self._on_next: Callable[[], None] = lambda: None
+        # parameters of the experiments the worker thread expired
+        self._expired_queue: Queue[np.ndarray] = Queue()
+        self._stopped = Event()
+        self._idle = metrics.IdleTime(outdir)
+        # since when the interface has been asking for a proposal in vain
+        self._track_rig_idle = track_rig_idle
+        self._empty_since: Optional[float] = None
+        # session of the last proposal read
+        self._session_num = 0
+        # session and time each experiment was taken, until its result is written
+        self._taken: Pending[Tuple[int, float]] = Pending()
+        # experiments expired before their result came, until it comes
+        self._expired: Pending[np.ndarray] = Pending()
         self._executor = ThreadPoolExecutor(max_workers=1)
         self._future = self._executor.submit(self._run)
-        self._submit_to_read()
-
+        self._future.add_done_callback(lambda future: self._on_next())
+        # keep up to lookahead proposals read ahead of the interface
+        for _ in range(max(1, lookahead)):
+            self._submit_to_read()
+        if expiry_interval is not None:
+            Thread(target=self._expire_periodically, args=(expiry_interval,), daemon=True).start()
+
+    @property
+    def on_next(self) -> Callable[[], None]:
+        return self._on_next
+
+    @on_next.setter
+    def on_next(self, on_next: Callable[[], None]) -> None:
+        # called from the worker thread whenever read() may have something new
+        self._on_next = on_next
+
+    @property
+    def ready(self) -> int:
+        return self._next_queue.qsize()
+
+    # the parameters of the experiments given up on after their timeout since the last call,
+    # among those read and without result
+    def pop_expired(self) -> List[np.ndarray]:
+        expired: List[np.ndarray] = []
+        while True:
+            try:
+                param = self._expired_queue.get_nowait()
+            except queue.Empty:
+                return expired
+            if self._taken.pop(param) is not None:
+                self._expired.add(param, param)
+                expired.append(param)
+
+    # returns whether the result frees a slot of the dispatch queue: every result does but the
+    # late one of an experiment already expired, whose slot its expiry freed; a result of no
+    # experiment read, such as the NaN of a rig still filling its delay line, frees one too.
+    # The adaptee gets it either way and ignores it if it has no use for it
     @_throwable
-    def write(self, last_param: np.ndarray, last_result: np.ndarray) -> None:
+    def write(self, last_param: np.ndarray, last_result: np.ndarray) -> bool:
+        taken = self._taken.pop(last_param)
+        if taken is not None:
+            session_num, taken_at = taken
+            self._idle.add(session_num, 'results', 1)
+            self._idle.add(session_num, 'experiment [s]', time.perf_counter() - taken_at)
         self._submit_to_write(last_param, last_result)
+        return taken is not None or self._expired.pop(last_param) is None
+
+    # the sequencer took the experiment with param; its timeout runs from now
+    @_throwable
+    def start(self, param: np.ndarray) -> None:
+        self._submit_to_start(param, time.monotonic())
 
     @_throwable
     def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        now = time.perf_counter()
         try:
-            next_param = self._next_queue.get_nowait()
+            next_param, session_num = self._next_queue.get_nowait()
             self._submit_to_read()
+            if next_param is not None:
+                self._idle.add(session_num, 'experiments', 1)
+                if self._track_rig_idle:
+                    self._idle.add(session_num, 'rig_idle [s]', 0.0 if self._empty_since is None else now - self._empty_since)
+                self._taken.add(next_param, (session_num, now))
+                self._session_num = session_num
+                self._idle.flush(session_num)
+            self._empty_since = None
             return next_param is not None, next_param
         except queue.Empty:
+            if self._empty_since is None:
+                self._empty_since = now
             return True, None
 
+    # the rig waited seconds for the proposal read last
+    def add_rig_idle(self, seconds: float) -> None:
+        self._idle.add(self._session_num, 'rig_idle [s]', seconds)
+
     @_throwable
     def shutdown(self) -> None:
+        self._idle.flush()
+        self._stopped.set()
         self._last_queue.put_nowait(lambda: False)
 
     def _submit_to_read(self) -> None:
 
         def request() -> bool:
             next_param = next(self._adaptee.reader, None)
-            self._next_queue.put_nowait(next_param)
+            self._next_queue.put_nowait((next_param, self._adaptee.session_num))
+            self._on_next()
             return next_param is not None
 
         self._last_queue.put_nowait(request)
@@ -85,7 +170,37 @@ class Adapter:
 
         self._last_queue.put_nowait(request)
 
+    def _submit_to_start(self, param: np.ndarray, now: float) -> None:
+
+        def request() -> bool:
+            self._adaptee.start(param, now)
+            return True
+
+        self._last_queue.put_nowait(request)
+
+    def _submit_to_expire(self) -> None:
+
+        def request() -> bool:
+            expired = self._adaptee.expire(time.monotonic())
+            if expired:
+                for param in expired:
+                    self._expired_queue.put_nowait(param)
+                self._on_next()
+            return True
+
+        self._last_queue.put_nowait(request)
+
+    def _expire_periodically(self, interval: float) -> None:
+        while not self._stopped.wait(interval):
+            self._submit_to_expire()
+
     def _run(self) -> None:
-        while True:
-            if not self._last_queue.get()():
-                break
+        try:
+            while True:
+                waiting_since = time.perf_counter()
+                request = self._last_queue.get()
+                self._idle.add(self._adaptee.session_num, 'learner_idle [s]', time.perf_counter() - waiting_since)
+                if not request():
+                    break
+        finally:
+            self._adaptee.close()
@@ -0,0 +1,52 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Tab-separated text encoding of float arrays shared by the interface and the
+# mock client. Each direction is a single call over the whole array instead
+# of a Python loop per element; fields that do not parse become NaN.
+
+
+from typing import Union
+
+import numpy as np
+
+
+SEPARATOR = '\t'
+
+# 12 digits after the decimal point, as the interface has always sent
+FIXED = '%.12f'
+
+# shortest round-trip representation, as str(float) gives
+SHORTEST = '%r'
+
+
+def format_array(array: Union[np.ndarray, list], fmt: str = FIXED, sep: str = SEPARATOR) -> str:
+    values = np.asarray(array, dtype=float).ravel().tolist()
+    return sep.join([fmt] * len(values)) % tuple(values)
+
+
+def parse_array(text: str, sep: str = SEPARATOR) -> np.ndarray:
+    fields = text.split(sep)
+    try:
+        return np.array(fields, dtype=float)
+    except ValueError:
+        return np.array([_parse_field(field) for field in fields])
+
+
+def _parse_field(field: str) -> float:
+    try:
+        return float(field)
+    except ValueError:
+        return float('nan')
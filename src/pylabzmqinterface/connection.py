@@ -13,7 +13,7 @@
 # limitations under the License.
 
 
-from typing import Callable, Generic, Iterator, Optional, TypeVar
+from typing import Callable, Generic, Iterator, List, Optional, TypeVar
 
 import numpy as np
 
@@ -28,14 +28,49 @@ class Connection(Adaptee, Generic[_T]):
     def __init__(self, on_connection: Iterator[_T], create_adaptee: Callable[[_T], Adaptee]) -> None:
         super().__init__()
         self._adaptee: Optional[Adaptee] = None
+        # earlier sessions, kept while results of their experiments may still come
+        self._earlier: List[Adaptee] = []
+        self._session_num = 0
         self._create_adaptee = create_adaptee
         self._on_connection = on_connection
 
-    def write(self, param: np.ndarray, result: np.ndarray):
-        if self._adaptee is not None:
-            self._adaptee.write(param, result)
+    @property
+    def session_num(self) -> int:
+        return self._session_num
+
+    # results in flight when a session ended go back to the session of their experiment
+    def write(self, param: np.ndarray, result: np.ndarray) -> bool:
+        for adaptee in self._adaptees:
+            if adaptee.write(param, result):
+                self._drop_finished()
+                return True
+        return False
+
+    def start(self, param: np.ndarray, now: float) -> bool:
+        return any(adaptee.start(param, now) for adaptee in self._adaptees)
+
+    def expire(self, now: float, param: Optional[np.ndarray] = None) -> List[np.ndarray]:
+        expired: List[np.ndarray] = []
+        for adaptee in self._adaptees:
+            expired += adaptee.expire(now, param)
+            if param is not None and expired:
+                break
+        self._drop_finished()
+        return expired
 
     def create_reader(self) -> Iterator[np.ndarray]:
         for on_session in self._on_connection:
+            self._session_num += 1
+            if self._adaptee is not None:
+                self._earlier.append(self._adaptee)
+                self._drop_finished()
             self._adaptee = self._create_adaptee(on_session)
             yield from self._adaptee.reader
+
+    # the earlier sessions first, their experiments were dispatched first
+    @property
+    def _adaptees(self) -> List[Adaptee]:
+        return self._earlier if self._adaptee is None else [*self._earlier, self._adaptee]
+
+    def _drop_finished(self) -> None:
+        self._earlier = [adaptee for adaptee in self._earlier if adaptee.num_pending > 0]
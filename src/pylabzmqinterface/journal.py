@@ -0,0 +1,170 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Append-only journal of the experiments of a connection, to resume after a
+# crash of the learner process.
+#
+# Each record is RECORD (kind, parameter count, result count) followed by the
+# parameters and, for RECEIVED, the results as little-endian float64. EXPIRED
+# records an experiment given up on after its timeout. The journal starts with
+# a HEADERS record: the initial parameters, then the parameter and result
+# headers as JSON, whose byte length takes the place of the result count. A
+# restarted server reads them with read_headers() to reattach to the running
+# sequencer without a new handshake. The other
+# records are written in the order the adaptee saw them, so replaying them
+# into a fresh learner built by the same main() (same seeds) brings its
+# generators, Policy.training and pending experiments back to the same state.
+
+
+import json
+import os.path
+import struct
+import time
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from src.common.math import allclose
+from src.pylabzmqinterface import protocol
+from src.pylabzmqinterface.adaptee import Adaptee
+from src.pylabzmqinterface.pending import Pending
+
+
+HEADERS = b'H'
+DISPATCHED = b'D'
+RECEIVED = b'R'
+EXPIRED = b'E'
+
+RECORD = struct.Struct('<cII')
+
+
+class Journal(Adaptee):
+
+    def __init__(self, adaptee: Adaptee, path: str, redispatch: bool = True, param_header: Optional[Iterable[str]] = None, result_header: Optional[Iterable[str]] = None, initial_param: Optional[np.ndarray] = None) -> None:
+        super().__init__()
+        self._adaptee = adaptee
+        self._path = path
+        self._redispatch = redispatch
+        self._param_header = None if param_header is None else [*param_header]
+        self._result_header = None if result_header is None else [*result_header]
+        self._initial_param = initial_param
+        self._file: BinaryIO = open(path, 'ab')
+
+    @property
+    def session_num(self) -> int:
+        return self._adaptee.session_num
+
+    def write(self, param: np.ndarray, result: np.ndarray) -> bool:
+        self._append(RECEIVED, param, result)
+        return self._adaptee.write(param, result)
+
+    def start(self, param: np.ndarray, now: float) -> bool:
+        return self._adaptee.start(param, now)
+
+    def expire(self, now: float, param: Optional[np.ndarray] = None) -> List[np.ndarray]:
+        expired = self._adaptee.expire(now, param)
+        for param in expired:
+            self._append(EXPIRED, param)
+        return expired
+
+    def close(self) -> None:
+        self._file.close()
+        self._adaptee.close()
+
+    def create_reader(self) -> Iterator[np.ndarray]:
+        pending, end = self._replay()
+        # drop a record cut off by the crash
+        self._file.truncate(end)
+        if end == 0 and self._param_header is not None and self._result_header is not None and self._initial_param is not None:
+            self._append_headers(self._param_header, self._result_header, self._initial_param)
+        # experiments without result may have been lost by the sequencer too
+        if self._redispatch:
+            yield from pending
+        else:
+            # still with the sequencer, so their timeouts run from now
+            now = time.monotonic()
+            for param in pending:
+                self._adaptee.start(param, now)
+        for param in self._adaptee.reader:
+            self._append(DISPATCHED, param)
+            yield param
+
+    def _replay(self) -> Tuple[List[np.ndarray], int]:
+        pending: Pending[np.ndarray] = Pending(self._param_header)
+        end = 0
+        for kind, param, result, end in read(self._path):
+            if kind == HEADERS:
+                continue
+            if kind == DISPATCHED:
+                dispatched = next(self._adaptee.reader, None)
+                if dispatched is None or not allclose(dispatched, param):
+                    raise RuntimeError(f'{self._path} does not match the learner (were main() or the seeds changed?)')
+                pending.add(dispatched, dispatched)
+            elif kind == EXPIRED:
+                self._adaptee.expire(0.0, param)
+                pending.pop(param)
+            else:
+                self._adaptee.write(param, result)
+                pending.pop(param)
+        return [dispatched for _, dispatched in pending], end
+
+    def _append_headers(self, param_header: List[str], result_header: List[str], initial_param: np.ndarray) -> None:
+        headers = json.dumps([param_header, result_header]).encode()
+        self._file.write(b''.join([RECORD.pack(HEADERS, len(initial_param), len(headers)), protocol.pack_array(initial_param).tobytes(), headers]))
+        self._file.flush()
+
+    def _append(self, kind: bytes, param: np.ndarray, result: Optional[np.ndarray] = None) -> None:
+        arrays = [param] if result is None else [param, result]
+        header = RECORD.pack(kind, len(param), 0 if result is None else len(result))
+        self._file.write(b''.join([header, *(protocol.pack_array(array).tobytes() for array in arrays)]))
+        self._file.flush()
+
+
+# (kind, parameters, results, end offset) of every complete record; the
+# results are empty but for RECEIVED, and the parameters of HEADERS are the
+# initial ones
+def read(path: str) -> Iterator[Tuple[bytes, np.ndarray, np.ndarray, int]]:
+    with open(path, 'rb') as file:
+        data = file.read()
+    offset = 0
+    while offset + RECORD.size <= len(data):
+        kind, num_params, num_results = RECORD.unpack_from(data, offset)
+        num_values = num_params if kind == HEADERS else num_params + num_results
+        end = offset + RECORD.size + protocol.FLOAT64.itemsize * num_values + (num_results if kind == HEADERS else 0)
+        if end > len(data):
+            break
+        values = np.frombuffer(data, dtype=protocol.FLOAT64, count=num_values, offset=offset + RECORD.size)
+        yield kind, values[:num_params].copy(), values[num_params:].copy(), end
+        offset = end
+
+
+# (parameter header, result header, initial parameters) the journal was
+# started with, or None if it has none yet
+def read_headers(path: str) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as file:
+        data = file.read(RECORD.size)
+        if len(data) < RECORD.size:
+            return None
+        kind, num_params, num_bytes = RECORD.unpack(data)
+        if kind != HEADERS:
+            return None
+        size = protocol.FLOAT64.itemsize * num_params
+        data = file.read(size + num_bytes)
+    if len(data) < size + num_bytes:
+        return None
+    param_header, result_header = json.loads(data[size:])
+    return np.array(param_header), np.array(result_header), np.frombuffer(data, dtype=protocol.FLOAT64, count=num_params).copy()
@@ -0,0 +1,140 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Learner of one campaign in a process of its own.
+#
+# The learner code, combo included, draws from the global np.random, so
+# campaigns served side by side in one process would change each other's
+# random numbers. A LearnerProcess is the Adaptee of such a campaign: it runs
+# the Connection and Sessions of the campaign in a child process and forwards
+# the calls of its Adapter over a pipe. Each child has its own np.random,
+# seeded by the learner as when the campaign runs alone, writes its files to
+# the output directory it is given and relays its progress events.
+#
+# The child is spawned, so create_on_connection must be picklable: a
+# function of the main script or a module, or a functools.partial of one.
+
+
+import multiprocessing
+import multiprocessing.connection
+import os
+from threading import Lock
+import traceback
+from typing import Any, Callable, Dict, Generator, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.pylabzmqinterface import progress
+from src.pylabzmqinterface.adaptee import Adaptee
+from src.pylabzmqinterface.connection import Connection
+from src.pylabzmqinterface.session import MAX_REDISPATCHES, REDISPATCH, Session
+
+
+# read by src when it is imported, so that a child writes to the directory it is given
+OUTDIR_ENV = 'PYLABZMQ_OUTDIR'
+
+# messages from the child: the reply to a call, its traceback, or a progress event
+_REPLY = 0
+_ERROR = 1
+_EVENT = 2
+
+# a child starts with the environment of the moment it is spawned
+_environ_lock = Lock()
+
+
+class LearnerProcess(Adaptee):
+
+    def __init__(self, create_on_connection: Callable[[], Iterator[Iterator[Generator[pd.Series, pd.Series, None]]]], param_header: np.ndarray, result_header: np.ndarray, initial_param: np.ndarray, timeout: Optional[float] = None, on_timeout: str = REDISPATCH, max_redispatches: int = MAX_REDISPATCHES, outdir: Optional[str] = None) -> None:
+        super().__init__()
+        self._session_num = 0
+        context = multiprocessing.get_context('spawn')
+        self._pipe, pipe = context.Pipe()
+        self._process = context.Process(target=_serve, args=(pipe, create_on_connection, param_header, result_header, initial_param, timeout, on_timeout, max_redispatches), daemon=True)
+        with _environ_lock:
+            environ = os.environ.get(OUTDIR_ENV)
+            if outdir is not None:
+                os.environ[OUTDIR_ENV] = outdir
+            try:
+                self._process.start()
+            finally:
+                if environ is None:
+                    os.environ.pop(OUTDIR_ENV, None)
+                else:
+                    os.environ[OUTDIR_ENV] = environ
+        pipe.close()
+
+    @property
+    def session_num(self) -> int:
+        return self._session_num
+
+    def write(self, param: np.ndarray, result: np.ndarray) -> bool:
+        return self._call('write', param, result)
+
+    def start(self, param: np.ndarray, now: float) -> bool:
+        return self._call('start', param, now)
+
+    def expire(self, now: float, param: Optional[np.ndarray] = None) -> List[np.ndarray]:
+        return self._call('expire', now, param)
+
+    def close(self) -> None:
+        if self._process.is_alive():
+            self._pipe.send(('close', ()))
+            self._process.join()
+        self._pipe.close()
+
+    def create_reader(self) -> Iterator[np.ndarray]:
+        while True:
+            param, self._session_num = self._call('read')
+            if param is None:
+                return
+            yield param
+
+    def _call(self, name: str, *args: Any) -> Any:
+        try:
+            self._pipe.send((name, args))
+            while True:
+                kind, value = self._pipe.recv()
+                if kind == _EVENT:
+                    progress.publish(*value)
+                elif kind == _ERROR:
+                    raise RuntimeError(f'{name} failed in the learner process:\n{value}')
+                else:
+                    return value
+        except (EOFError, OSError):
+            raise RuntimeError(f'the learner process exited with code {self._process.exitcode}')
+
+
+def _serve(pipe: multiprocessing.connection.Connection, create_on_connection: Callable[[], Iterator[Iterator[Generator[pd.Series, pd.Series, None]]]], param_header: np.ndarray, result_header: np.ndarray, initial_param: np.ndarray, timeout: Optional[float], on_timeout: str, max_redispatches: int) -> None:
+    progress.relay(lambda topic, number, value: pipe.send((_EVENT, (topic, number, value))))
+    connection = Connection(create_on_connection(), lambda on_session: Session(on_session, param_header, result_header, initial_param, timeout, on_timeout, max_redispatches))
+    calls: Dict[str, Callable[..., Any]] = {
+        'read': lambda: (next(connection.reader, None), connection.session_num),
+        'write': connection.write,
+        'start': connection.start,
+        'expire': connection.expire,
+    }
+    while True:
+        try:
+            name, args = pipe.recv()
+        except EOFError:
+            # the parent is gone
+            break
+        if name == 'close':
+            break
+        try:
+            pipe.send((_REPLY, calls[name](*args)))
+        except Exception:
+            pipe.send((_ERROR, traceback.format_exc()))
@@ -0,0 +1,239 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Timing instrumentation of PyLabInterface.
+#
+# Every duration goes into a Histogram of power-of-two microsecond buckets
+# (bucket k counts durations up to 2**k us, the last one everything above).
+#
+#   command:<name>  from receiving a request to sending its reply; long-poll
+#                   commands include the time they were held
+#   queue_wait      upper bound of the time a request was already waiting
+#                   while the interface was busy outside poll()
+#   dispatch        from receiveNextExp to the sequencer taking the
+#                   experiment (sendNextExpAsStr and friends, or ackExp)
+#   lookahead_wait  from a free dispatch slot to the learner having a
+#                   proposal ready, only when it was not ready already
+#
+# Counts go into a Gauge of their values instead:
+#
+#   lookahead       proposals read ahead by the Adapter, including the one
+#                   being taken, each time the interface takes one
+#
+# Metrics of all interfaces of the process are written to one TSV file by
+# dump(), on demand (the dumpMetrics() command) or every interval seconds.
+#
+# IdleTime adds up, per session of an Adapter, how long the sequencer waited
+# for the learner and the learner for the sequencer. A row per session is
+# appended to IDLE_FILE once a later session has started or the Adapter is
+# shut down. The file goes to the output directory of the Adapter's learner,
+# next to its history.learner.tsv (OUTDIR/campaign<number> with --interleave,
+# OUTDIR/<identity> with --router), or else to the metrics directory; it is
+# written only while metrics are enabled.
+
+
+import math
+import os.path
+from threading import Lock, Thread
+import time
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+
+NUM_BUCKETS = 24
+
+IDLE_FILE = 'history.idle.tsv'
+
+
+class Histogram:
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.counts = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        # 2**(exponent - 1) <= us < 2**exponent, but bucket k counts 2**k us itself
+        mantissa, exponent = math.frexp(seconds * 1e6)
+        if mantissa == 0.5:
+            exponent -= 1
+        self.counts[min(NUM_BUCKETS - 1, max(0, exponent))] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_series(self) -> pd.Series:
+        return pd.Series(
+            [self.count, 1e3 * self.total / max(1, self.count), 1e3 * self.max, *self.counts],
+            index=['count', 'mean [ms]', 'max [ms]', *(f'<={2 ** k}us' for k in range(NUM_BUCKETS - 1)), 'more'],
+        )
+
+
+class Gauge:
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.counts = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value: int) -> None:
+        self.counts[min(NUM_BUCKETS - 1, max(0, value))] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def to_series(self) -> pd.Series:
+        return pd.Series(
+            [self.count, self.total / max(1, self.count), self.max, *self.counts],
+            index=['count', 'mean', 'max', *(f'={k}' for k in range(NUM_BUCKETS - 1)), 'more'],
+        )
+
+
+class Metrics:
+
+    def __init__(self, name: str) -> None:
+        super().__init__()
+        self.name = name
+        self._histograms: Dict[str, Histogram] = {}
+        self._gauges: Dict[str, Gauge] = {}
+        self._queued: Dict[int, float] = {}
+        # written by the interface loop, read by the dumping thread
+        self._lock = Lock()
+        _registry.append(self)
+
+    def add(self, metric: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(metric)
+            if histogram is None:
+                histogram = self._histograms[metric] = Histogram()
+            histogram.add(seconds)
+
+    def observe(self, metric: str, value: int) -> None:
+        with self._lock:
+            gauge = self._gauges.get(metric)
+            if gauge is None:
+                gauge = self._gauges[metric] = Gauge()
+            gauge.add(value)
+
+    def add_command(self, command: str, seconds: float) -> None:
+        self.add('command:' + command, seconds)
+
+    def queued(self, ticket: int, now: float) -> None:
+        self._queued[ticket] = now
+
+    def taken(self, ticket: int, now: float) -> None:
+        queued = self._queued.pop(ticket, None)
+        if queued is not None:
+            self.add('dispatch', now - queued)
+
+    def to_frame(self) -> pd.DataFrame:
+        with self._lock:
+            table = pd.concat([
+                pd.DataFrame({metric: histogram.to_series() for metric, histogram in self._histograms.items()}).T,
+                pd.DataFrame({metric: gauge.to_series() for metric, gauge in self._gauges.items()}).T,
+            ])
+        # histograms and gauges leave each other's columns empty
+        table = table.astype({column: 'Int64' for column in table.columns if not column.startswith('mean') and not column.endswith('[ms]')})
+        table.index.name = 'metric'
+        table.insert(0, 'interface', self.name)
+        return table
+
+
+class IdleTime:
+
+    COLUMNS = [
+        'session_num',
+        'experiments',      # taken by the interface
+        'results',          # written back
+        'rig_idle [s]',     # the interface had a free slot but no proposal was ready
+        'learner_idle [s]', # the Adapter worker had nothing to do
+        'experiment [s]',   # from taking an experiment to writing its result
+    ]
+
+    def __init__(self, outdir: Optional[str] = None) -> None:
+        super().__init__()
+        self._outdir = outdir
+        self._sessions: Dict[int, List[float]] = {}
+        # sessions before it were written already; late results of them are not counted
+        self._flushed = 0
+        # written by both the interface loop and the Adapter worker
+        self._lock = Lock()
+
+    def add(self, session_num: int, column: str, value: float) -> None:
+        with self._lock:
+            if session_num < self._flushed:
+                return
+            totals = self._sessions.get(session_num)
+            if totals is None:
+                totals = self._sessions[session_num] = [0.0] * (len(self.COLUMNS) - 1)
+            totals[self.COLUMNS.index(column) - 1] += value
+
+    # write the sessions before session_num, or all of them
+    def flush(self, session_num: Optional[int] = None) -> None:
+        with self._lock:
+            done = sorted(key for key in self._sessions if session_num is None or key < session_num)
+            # sessions without experiments are the wait for the first one
+            rows = [[key, *totals] for key, totals in ((key, self._sessions.pop(key)) for key in done) if totals[0] > 0]
+            if session_num is not None:
+                self._flushed = max(self._flushed, session_num)
+        if rows:
+            write_idle(pd.DataFrame(rows, columns=self.COLUMNS).astype({'session_num': int, 'experiments': int, 'results': int}), self._outdir)
+
+
+_registry: List[Metrics] = []
+
+_path: Optional[str] = None
+
+_idle_dir: Optional[str] = None
+
+_idle_lock = Lock()
+
+
+def enable(outdir: str, interval: Optional[float] = None) -> None:
+    global _path, _idle_dir
+    _path = os.path.join(outdir, 'metrics.tsv')
+    _idle_dir = outdir
+    if interval is not None:
+        Thread(target=_dump_periodically, args=(interval,), daemon=True).start()
+
+
+def dump() -> Optional[str]:
+    if _path is None or not _registry:
+        return None
+    pd.concat([metrics.to_frame() for metrics in [*_registry]]).to_csv(_path, sep='\t')
+    return _path
+
+
+def write_idle(table: pd.DataFrame, outdir: Optional[str] = None) -> None:
+    if _idle_dir is None:
+        return
+    path = os.path.join(_idle_dir if outdir is None else outdir, IDLE_FILE)
+    with _idle_lock:
+        if os.path.exists(path):
+            table.to_csv(path, sep='\t', header=False, index=False, mode='a')
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            table.to_csv(path, sep='\t', header=True, index=False, mode='w')
+
+
+def _dump_periodically(interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        dump()
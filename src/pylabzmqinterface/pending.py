@@ -0,0 +1,134 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Index of the experiments dispatched to the sequencer and still waiting for
+# their result.
+#
+# When the parameter header has a KEY column (the scanNum the learner
+# prepends to every parameter, unique per duplicate) a result is matched by a
+# dict lookup. Otherwise the pending parameters are stacked in a matrix and
+# matched with a single vectorized tolerance test. Either way, identical
+# parameters are matched first in, first out.
+
+
+from collections import deque
+from typing import Deque, Dict, Generic, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+import numpy as np
+
+from src.common.math import isclose
+
+
+KEY = 'scanNum'
+
+_T = TypeVar('_T')
+
+
+class Pending(Generic[_T]):
+
+    def __init__(self, param_header: Optional[Iterable[str]] = None, rtol: float = 1e-8, atol: float = 1e-8, capacity: int = 16) -> None:
+        header = [] if param_header is None else [*param_header]
+        self._key: Optional[int] = header.index(KEY) if KEY in header else None
+        self._rtol = rtol
+        self._atol = atol
+        self._keyed: Dict[float, Deque[Tuple[np.ndarray, _T]]] = {}
+        self._params: Optional[np.ndarray] = None
+        self._orders = np.zeros(capacity, dtype=np.int64)
+        self._values: List[_T] = []
+        self._capacity = capacity
+        self._next_order = 0
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[Tuple[np.ndarray, _T]]:
+        if self._key is not None:
+            for items in [*self._keyed.values()]:
+                yield from [*items]
+        elif self._params is not None:
+            params = self._params
+            for i in np.argsort(self._orders[:self._len], kind='stable'):
+                yield params[i], self._values[i]
+
+    def add(self, param: np.ndarray, value: _T) -> None:
+        if self._key is not None:
+            self._keyed.setdefault(float(param[self._key]), deque()).append((param, value))
+        else:
+            self._append(param, value)
+        self._len += 1
+
+    def pop(self, param: np.ndarray) -> Optional[_T]:
+        if self._key is not None:
+            items = self._keyed.get(float(param[self._key]))
+            if not items:
+                return None
+            _, value = items.popleft()
+            if not items:
+                del self._keyed[float(param[self._key])]
+            self._len -= 1
+            return value
+        return self._pop_close(param)
+
+    # remove the very entry of value added with param, if it is still pending
+    def discard(self, param: np.ndarray, value: _T) -> bool:
+        if self._key is not None:
+            items = self._keyed.get(float(param[self._key]), deque())
+            for i, (_, pending) in enumerate(items):
+                if pending is value:
+                    del items[i]
+                    if not items:
+                        del self._keyed[float(param[self._key])]
+                    self._len -= 1
+                    return True
+            return False
+        if self._params is None:
+            return False
+        for i in range(self._len):
+            if self._values[i] is value:
+                self._remove(self._params, i)
+                return True
+        return False
+
+    def _append(self, param: np.ndarray, value: _T) -> None:
+        if self._params is None:
+            self._params = np.empty((self._capacity, len(param)))
+        elif self._len == len(self._params):
+            self._params = np.concatenate([self._params, np.empty_like(self._params)])
+            self._orders = np.concatenate([self._orders, np.zeros_like(self._orders)])
+        self._params[self._len] = param
+        self._orders[self._len] = self._next_order
+        self._values.append(value)
+        self._next_order += 1
+
+    def _pop_close(self, param: np.ndarray) -> Optional[_T]:
+        if self._params is None or self._len == 0 or self._params.shape[1] != len(param):
+            return None
+        matches = np.flatnonzero(isclose(self._params[:self._len], param, rtol=self._rtol, atol=self._atol).all(axis=1))
+        if len(matches) == 0:
+            return None
+        i = matches[np.argmin(self._orders[matches])]
+        value = self._values[i]
+        self._remove(self._params, i)
+        return value
+
+    def _remove(self, params: np.ndarray, i: int) -> None:
+        # move the last row into the hole, the orders keep the matching FIFO
+        last = self._len - 1
+        params[i] = params[last]
+        self._orders[i] = self._orders[last]
+        self._values[i] = self._values[last]
+        self._values.pop()
+        self._len -= 1
@@ -0,0 +1,99 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Progress events broadcast on an optional PUB socket.
+#
+# Each event is a two-frame message: the topic (subscribers filter on it)
+# and EVENT packed as (unix time, integer field, float field).
+#
+#   DISPATCHED   number of experiments sent to the sequencer so far
+#   RECEIVED     number of results received so far
+#   EXPIRED      number of experiments given up on after their timeout so far
+#   PROBE        probe number started by the learner
+#   BEST         number of results in Policy.history, best value so far
+#   REFIT_START  training size the predictor is fitted on
+#   REFIT_END    training size, seconds spent fitting
+#
+# A learner process relays its events to the parent process, which
+# publishes them.
+
+
+import struct
+from threading import Lock
+import time
+from typing import Callable, List, Optional, Tuple, Union
+
+import zmq
+
+
+DISPATCHED = b'dispatched'
+RECEIVED = b'received'
+EXPIRED = b'expired'
+PROBE = b'probe'
+BEST = b'best'
+REFIT_START = b'refit_start'
+REFIT_END = b'refit_end'
+
+EVENT = struct.Struct('<dqd')
+
+
+class Publisher:
+
+    def __init__(self, binder: str, context: Optional[zmq.Context] = None) -> None:
+        super().__init__()
+        self._socket = (zmq.Context.instance() if context is None else context).socket(zmq.PUB)
+        self._socket.bind(binder)
+        # events come from both the interface loop and the learner thread
+        self._lock = Lock()
+
+    def publish(self, topic: bytes, number: int = 0, value: float = float('nan')) -> None:
+        message = [topic, EVENT.pack(time.time(), number, value)]
+        with self._lock:
+            self._socket.send_multipart(message)
+
+
+class Relay:
+
+    def __init__(self, send: Callable[[bytes, int, float], None]) -> None:
+        super().__init__()
+        self._send = send
+        self._lock = Lock()
+
+    def publish(self, topic: bytes, number: int = 0, value: float = float('nan')) -> None:
+        with self._lock:
+            self._send(topic, number, value)
+
+
+_publisher: Optional[Union[Publisher, Relay]] = None
+
+
+def bind(binder: str) -> None:
+    global _publisher
+    _publisher = Publisher(binder)
+
+
+def relay(send: Callable[[bytes, int, float], None]) -> None:
+    global _publisher
+    _publisher = Relay(send)
+
+
+def publish(topic: bytes, number: int = 0, value: float = float('nan')) -> None:
+    if _publisher is not None:
+        _publisher.publish(topic, number, value)
+
+
+def unpack(message: List[bytes]) -> Tuple[bytes, float, int, float]:
+    topic, payload = message
+    return (topic, *EVENT.unpack(payload))
@@ -0,0 +1,82 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Binary wire protocol used alongside the eval/tab-string one.
+#
+# A binary message is a ZMQ multipart message whose first frame is a header
+# starting with BINARY_MARK followed by an UTF-8 token (the command name for
+# requests, the status or scalar value for replies). Every following frame
+# is a raw little-endian float64 buffer. Text messages never start with a NUL
+# byte, so both protocols can share a single socket.
+
+
+from typing import Any, List, Sequence, Union
+
+import numpy as np
+import zmq
+
+
+BINARY_MARK = b'\x00'
+
+FLOAT64 = np.dtype('<f8')
+
+# reply of a long-poll command whose timeout passed before anything was ready
+PENDING = 'pending'
+
+
+def is_binary(frame: Union[bytes, zmq.Frame]) -> bool:
+    if isinstance(frame, zmq.Frame):
+        return frame.buffer[:len(BINARY_MARK)] == BINARY_MARK
+    return frame.startswith(BINARY_MARK)
+
+
+def pack_header(token: str) -> bytes:
+    return BINARY_MARK + token.encode()
+
+
+def unpack_header(frame: Union[bytes, zmq.Frame]) -> str:
+    if isinstance(frame, zmq.Frame):
+        frame = frame.bytes
+    return frame[len(BINARY_MARK):].decode()
+
+
+def pack_array(array: np.ndarray) -> np.ndarray:
+    return np.ascontiguousarray(array, dtype=FLOAT64)
+
+
+def unpack_array(frame: Union[bytes, zmq.Frame]) -> np.ndarray:
+    if isinstance(frame, zmq.Frame):
+        return np.frombuffer(frame.buffer, dtype=FLOAT64)
+    return np.frombuffer(frame, dtype=FLOAT64)
+
+
+# command name of a binary or text request, without parsing its arguments
+def get_command(frames: Sequence[Union[bytes, zmq.Frame]]) -> str:
+    if is_binary(frames[0]):
+        return unpack_header(frames[0])
+    frame = frames[0].bytes if isinstance(frames[0], zmq.Frame) else frames[0]
+    return frame.decode().split('(', 1)[0].strip()
+
+
+def pack_reply(value: Any) -> List[Any]:
+    if isinstance(value, np.ndarray):
+        return [pack_header(''), pack_array(value)]
+    if isinstance(value, tuple):
+        return [pack_header(''), *map(pack_array, value)]
+    if isinstance(value, (bool, np.bool_)):
+        return [pack_header('true' if value else 'false')]
+    if value is None:
+        return [pack_header('null')]
+    return [pack_header(str(value))]
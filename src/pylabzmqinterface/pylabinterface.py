@@ -13,13 +13,72 @@
 # limitations under the License.
 
 
+import ast
+from collections import OrderedDict
+from functools import lru_cache
 import json
-from typing import Any, Callable, Optional
+from logging import getLogger
+import math
+import re
+from itertools import islice
+from threading import Lock
+import time
+from typing import Any, Callable, Dict, Optional, Tuple, Union
 
 import numpy as np
 import zmq
 
+from . import codec, metrics, progress, protocol, recorder
 from .adapter import Adapter
+from .scheduler import Scheduler
+
+
+_logger = getLogger(__name__)
+
+#"name(arg, ..., key=arg, ...)" as sent by the sequencer
+_CALL_PATTERN = re.compile(r'\s*(\w+)\s*\((.*)\)\s*\Z', re.DOTALL)
+#one argument, by keyword or not: a double or single quoted string, or a bare literal such as a number
+_ARG_PATTERN = re.compile(r'\s*(?:(\w+)\s*=(?!=)\s*)?(?:"((?:[^"\\]|\\.)*)"|\'((?:[^\'\\]|\\.)*)\'|([^,\s"\']+))\s*(?:,|\Z)', re.DOTALL)
+
+
+#parse a command without eval into its name, positional arguments and (keyword, argument) pairs;
+#arguments are string or literal, keyword ones after the others, as in Python.
+#raises SyntaxError/NameError like eval would
+@lru_cache(maxsize=256)
+def parseCommand(message: str) -> Tuple[str, Tuple[Any, ...], Tuple[Tuple[str, Any], ...]]:
+    match = _CALL_PATTERN.match(message)
+    if match is None:
+        raise SyntaxError(message)
+    name, argsStr = match.groups()
+    args = []
+    kwargs: Dict[str, Any] = {}
+    pos = 0
+    end = len(argsStr.rstrip())
+    while pos < end:
+        argMatch = _ARG_PATTERN.match(argsStr, pos)
+        if argMatch is None:
+            raise SyntaxError(message)
+        keyword, doubleQuoted, singleQuoted, bare = argMatch.groups()
+        if doubleQuoted is not None:
+            arg = ast.literal_eval('"' + doubleQuoted + '"') if "\\" in doubleQuoted else doubleQuoted
+        elif singleQuoted is not None:
+            arg = ast.literal_eval("'" + singleQuoted + "'") if "\\" in singleQuoted else singleQuoted
+        elif bare.isidentifier() and bare not in ("True", "False", "None"):
+            raise NameError(bare)
+        else:
+            arg = ast.literal_eval(bare)
+        if keyword is not None:
+            #a keyword given twice
+            if keyword in kwargs:
+                raise SyntaxError(message)
+            kwargs[keyword] = arg
+        elif kwargs:
+            #a positional argument after a keyword one
+            raise SyntaxError(message)
+        else:
+            args.append(arg)
+        pos = argMatch.end()
+    return name, tuple(args), tuple(kwargs.items())
 
 
 class NumpyEncoder(json.JSONEncoder):
@@ -49,8 +108,20 @@ class NumpyEncoder(json.JSONEncoder):
         return json.JSONEncoder(self, obj)
 
 
+class Deferred(object):
+    #reply held back by a long-poll command until resolve() gives a value or the deadline passes
+    def __init__(self, timeout, resolve) -> None:
+        self.deadline = time.monotonic() + float(timeout)
+        self.resolve = resolve
+        self.send: Callable[[Any], None] = lambda value: None
+
+
 class PyLabInterface(object):
-    def __init__(self, binder) -> None:
+
+    commands: Dict[str, Callable[..., Any]]
+    binaryCommands: Dict[str, Callable[..., Any]]
+
+    def __init__(self, binder, context: Optional[zmq.Context] = None, queueDepth: int = 1) -> None:
         #flags for sequencer state control
         self.sequencerReady = False
         #flags for learner state control
@@ -66,11 +137,31 @@ class PyLabInterface(object):
         self.lastExpUnread = False
         #Next parameters to experimenter
         self.nextExpParam = np.array([0], dtype = float)
-        self.nextExpUnread = False
+        #dispatch queue: ticket -> parameters, kept until acknowledged or read by sendNextExpAsStr
+        self.queueDepth = queueDepth
+        self.nextExpQueue: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        self.nextTicket = 0
+        #called with the parameters whenever the sequencer takes a queued experiment over
+        self.onExpTaken: Callable[[np.ndarray], None] = lambda param: None
+        #Long-poll request waiting for its reply
+        self.deferredReply: Optional[Deferred] = None
         #zeroMQ socket
-        self.context = zmq.Context()
+        #the process-wide context by default, so that an inproc client in the same process can connect
+        self.context = zmq.Context.instance() if context is None else context
         self.socket = self.context.socket(zmq.REP)
         self.socket.bind(binder)
+        #inproc pair waking the main loop when the learner has a new proposal
+        signalAddress = "inproc://pylabinterface-signal-%x" % id(self)
+        self.signalReceiver = self.context.socket(zmq.PAIR)
+        self.signalReceiver.bind(signalAddress)
+        self.signalSender = self.context.socket(zmq.PAIR)
+        self.signalSender.connect(signalAddress)
+        self.signalLock = Lock()
+        #timing of requests and dispatched experiments
+        self.metrics = metrics.Metrics(str(binder))
+        self.busySince = time.perf_counter()
+        self.requestStart = self.busySince
+        self.requestCommand = ""
 
         #initialize state flags manually
     def reInitialize(self):
@@ -79,7 +170,7 @@ class PyLabInterface(object):
         self.paramHeaderReceived = False
         self.resultHeaderReceived = False
         self.lastExpUnread = False
-        self.nextExpUnread = False
+        self.nextExpQueue.clear()
         return "Re-initialized."
 
         #sequencer state control
@@ -104,24 +195,129 @@ class PyLabInterface(object):
         #methods for ZMQ socket
     def solveRequest(self):
         #  Wait for request from client
-        message = self.socket.recv_string()
-        print("Received request: %s" % message)
-        offsetStr = "self."
-        message = offsetStr + message
+        frames = self.socket.recv_multipart(copy=False)
+        self.requestStart = time.perf_counter()
+        self.requestCommand = protocol.get_command(frames)
+        recorder.record(recorder.REQUEST, frames)
+        if protocol.is_binary(frames[0]):
+            reply = self.solveBinaryRequest(frames)
+        else:
+            reply = self.solveTextRequest(frames[0].bytes.decode())
+        if isinstance(reply, Deferred):
+            self.deferredReply = reply
+            self.resolveDeferredReply()
+        else:
+            self.sendReply(reply)
+
+    #str for a text reply, list of frames for a binary one
+    def sendReply(self, reply):
+        if isinstance(reply, str):
+            self.socket.send_string(reply)
+            recorder.record(recorder.REPLY, [reply])
+        else:
+            self.socket.send_multipart(reply, copy=False)
+            recorder.record(recorder.REPLY, reply)
+        command = self.requestCommand if self.requestCommand in self.commands or self.requestCommand in self.binaryCommands else "unknown"
+        self.metrics.add_command(command, time.perf_counter() - self.requestStart)
+
+    def close(self):
+        self.socket.close()
+        self.signalReceiver.close()
+        with self.signalLock:
+            self.signalSender.close()
+
+    #send the long-poll reply if it is ready or timed out; returns the seconds still to wait
+    def resolveDeferredReply(self):
+        reply = self.deferredReply
+        if reply is None:
+            return None
+        value = reply.resolve()
+        if value is None:
+            remaining = reply.deadline - time.monotonic()
+            if remaining > 0:
+                return remaining
+            value = protocol.PENDING
+        self.deferredReply = None
+        reply.send(value)
+        return None
+
+    #serve one request or learner signal, sleeping in poll() until either arrives
+    def waitRequest(self, poller):
+        timeout = self.resolveDeferredReply()
+        #a request already waiting arrived at the earliest when the loop left poll() last time
+        events = dict(poller.poll(0))
+        if self.socket in events:
+            self.metrics.add('queue_wait', time.perf_counter() - self.busySince)
+        elif not events:
+            events = dict(poller.poll(None if timeout is None else math.ceil(1000 * timeout)))
+        self.busySince = time.perf_counter()
+        if self.signalReceiver in events:
+            self.clearSignals()
+        if self.socket in events:
+            self.solveRequest()
+
+    def solveTextRequest(self, message):
+        _logger.debug("Received request: %s", message)
         try:
-            r = eval(message)
-            print(("Return value: ", r))
-            print(("Type: ", type(r)))
-            self.socket.send_string(json.dumps(r, cls=NumpyEncoder))
+            name, args, kwargs = parseCommand(message)
+            solve = self.commands.get(name)
+            if solve is None:
+                raise NameError(name)
+            r = solve(self, *args, **dict(kwargs))
+            if isinstance(r, Deferred):
+                r.send = lambda value: self.sendReply(json.dumps(value, cls=NumpyEncoder))
+                return r
+            _logger.debug("Return value: %r (%s)", r, type(r))
+            return json.dumps(r, cls=NumpyEncoder)
         except NameError:
-            print("except NameError")
-            self.socket.send_string("Unknown command")
+            _logger.debug("except NameError", exc_info=True)
+            return "Unknown command"
         except SyntaxError:
-            print("except SyntaxError")
-            self.socket.send_string("Invalid syntax")
+            _logger.debug("except SyntaxError", exc_info=True)
+            return "Invalid syntax"
         except:
-            print("except")
-            self.socket.send_string("Unknown error")
+            _logger.debug("except", exc_info=True)
+            return "Unknown error"
+
+    #multipart request: header frame with command name, then raw float64 frames
+    def solveBinaryRequest(self, frames):
+        command = protocol.unpack_header(frames[0])
+        solve = self.binaryCommands.get(command)
+        if solve is None:
+            return [protocol.pack_header("Unknown command")]
+        try:
+            r = solve(self, *frames[1:])
+            if isinstance(r, Deferred):
+                r.send = lambda value: self.sendReply(protocol.pack_reply(value))
+                return r
+            return protocol.pack_reply(r)
+        except:
+            _logger.debug("except", exc_info=True)
+            return [protocol.pack_header("Unknown error")]
+
+        #methods for the learner-side signal (may be called from other threads)
+    def notify(self):
+        with self.signalLock:
+            #the learner may still finish a proposal after run() has returned
+            if self.signalSender.closed:
+                return
+            try:
+                self.signalSender.send(b"", zmq.NOBLOCK)
+            except zmq.Again:
+                #a wake-up is already pending
+                pass
+
+    def clearSignals(self):
+        while True:
+            try:
+                self.signalReceiver.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+
+        #methods for instrumentation
+    #write the metrics of all interfaces to OUTDIR; returns the path, or None if not enabled
+    def dumpMetrics(self):
+        return metrics.dump()
 
         #methods for headers (name of parameters/results)
     def isHeaderInitialized(self):
@@ -176,95 +372,252 @@ class PyLabInterface(object):
 
         #methods for next Experiment IO
     def isNextExpUnread(self):
-        return self.nextExpUnread
+        return len(self.nextExpQueue) > 0
 
     def receiveNextExp(self, expArray):
-        self.nextExpParam = expArray
-        self.nextExpUnread = True
+        ticket = self.nextTicket
+        self.nextTicket += 1
+        self.nextExpQueue[ticket] = expArray
+        self.metrics.queued(ticket, time.perf_counter())
+        return ticket
+
+    #take the oldest queued parameters; without any, the last ones are sent again
+    def popNextExp(self):
+        if self.nextExpQueue:
+            ticket, self.nextExpParam = self.nextExpQueue.popitem(last=False)
+            self.metrics.taken(ticket, time.perf_counter())
+            self.onExpTaken(self.nextExpParam)
+        return self.nextExpParam
 
     def sendNextExpAsStr(self):
-        self.nextExpUnread = False
-        return self.npArray2Str(self.nextExpParam)
+        return self.npArray2Str(self.popNextExp())
+
+    #long-poll: reply with sendNextExpAsStr() as soon as receiveNextExp fires, or PENDING after timeout seconds
+    def waitNextExp(self, timeout):
+        return Deferred(timeout, lambda: self.sendNextExpAsStr() if self.isNextExpUnread() else None)
+
+        #methods for the dispatch queue (sequencer keeps up to queueDepth experiments)
+    #up to n queued experiments as [ticket, parameters]; they stay queued (and are sent again) until ackExp
+    def peekNextExps(self, n=None):
+        return list(islice(self.nextExpQueue.items(), self.queueDepth if n is None else int(n)))
+
+    def sendNextExpsAsStr(self, n=None):
+        return [[ticket, self.npArray2Str(param)] for ticket, param in self.peekNextExps(n)]
+
+    #the sequencer took these experiments over; returns how many were still queued
+    def ackExp(self, *tickets):
+        acked = 0
+        for ticket in tickets:
+            param = self.nextExpQueue.pop(int(ticket), None)
+            if param is not None:
+                self.nextExpParam = param
+                self.metrics.taken(int(ticket), time.perf_counter())
+                self.onExpTaken(param)
+                acked += 1
+        return acked
+
+        #binary counterparts of the tab-string IO (no text encoding at all)
+    def receiveLastExpAsBuffer(self, paramFrame, resultFrame):
+        self.lastExpParam = protocol.unpack_array(paramFrame)
+        self.lastExpResult = protocol.unpack_array(resultFrame)
+        self.lastExpUnread = True
+        return self.lastExpParam
+
+    def sendNextExpAsBuffer(self):
+        return self.popNextExp()
+
+    def waitNextExpAsBuffer(self, timeoutFrame):
+        return Deferred(protocol.unpack_array(timeoutFrame)[0], lambda: self.sendNextExpAsBuffer() if self.isNextExpUnread() else None)
+
+    #tickets frame, then one parameters frame per queued experiment
+    def sendNextExpsAsBuffer(self, countFrame=None):
+        exps = self.peekNextExps(None if countFrame is None else protocol.unpack_array(countFrame)[0])
+        return (np.array([ticket for ticket, _ in exps], dtype=float), *(param for _, param in exps))
+
+    def ackExpAsBuffer(self, ticketFrame):
+        return self.ackExp(*protocol.unpack_array(ticketFrame))
+
+        #methods for a whole cycle in one round trip
+    #take the last experiment and reply with the next parameters, or PENDING if none within timeout seconds
+    def exchangeAsStr(self, paramStr, resultStr, timeout=0):
+        self.receiveLastExpAsStr(paramStr, resultStr)
+        return self.waitNextExp(timeout)
+
+    def exchangeAsBuffer(self, paramFrame, resultFrame, timeoutFrame=None):
+        self.receiveLastExpAsBuffer(paramFrame, resultFrame)
+        return Deferred(0 if timeoutFrame is None else protocol.unpack_array(timeoutFrame)[0], lambda: self.sendNextExpAsBuffer() if self.isNextExpUnread() else None)
 
     @staticmethod
     def npArray2Str(npArray):
-        npAsStr = ""
-        for num in npArray:
-            npAsStr += f'{num:.12f}'
-            npAsStr += "\t"
-        return npAsStr.rstrip("\t")
+        return codec.format_array(npArray, codec.FIXED)
 
-    #slice the camma separated array str into nparray
+    #slice the tab separated array str into nparray
     @staticmethod
     def str2NParray(arrayStr):
-        #print arrayStr.split(",")
-        list = []
-        for valStr in arrayStr.split("\t"):
-            try:
-                valNum = float(valStr)
-            except:
-                valNum = float("NaN")
-            list.append(valNum)
-        npArray = np.array(list)
-        return npArray
+        return codec.parse_array(arrayStr)
 
     @classmethod
-    def run(cls, binder: Any, create_adapter: Callable[[np.ndarray, np.ndarray, np.ndarray], Adapter]) -> None:
+    def run(cls, binder: Any, create_adapter: Callable[[np.ndarray, np.ndarray, np.ndarray], Union[Adapter, Scheduler]], context: Optional[zmq.Context] = None, queueDepth: int = 1, resume: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None) -> None:
 
-        adapter: Optional[Adapter] = None
+        adapter: Optional[Union[Adapter, Scheduler]] = None
 
         #make PyLabInterface instance
-        self = cls(binder)
+        self = cls(binder, context, queueDepth)
         try:
             self.learnerStopped()
 
             #initialize learner's parameter
-            isNextExperimentReady = False
+            isLearnerRunning = True
             lastExperiment = self.getLastParam()
-
-            #wait initialize of headers
-            while not self.isHeaderInitialized():
-                self.solveRequest()
-
-            #Store headers and Learner get ready
-            paramHeader = self.getParamHeader()
-            resultHeader = self.getResultHeader()
-            self.learnerRunning()
-
-            #wait sequencer get ready
-            while not self.isSequencerRunning():
-                self.solveRequest()
+            #experiments dispatched but without result yet = numDispatched - numReceived - numExpired
+            numDispatched = 0
+            numReceived = 0
+            numExpired = 0
+            #since when a free slot is waiting for the learner
+            demandSince = None
+
+            #wake on either a request from experimenter or a signal from the learner
+            poller = zmq.Poller()
+            poller.register(self.socket, zmq.POLLIN)
+            poller.register(self.signalReceiver, zmq.POLLIN)
+
+            if resume is None:
+                #wait initialize of headers
+                while not self.isHeaderInitialized():
+                    self.waitRequest(poller)
+
+                #Store headers and Learner get ready
+                paramHeader = self.getParamHeader()
+                resultHeader = self.getResultHeader()
+                self.learnerRunning()
+
+                #wait sequencer get ready
+                while not self.isSequencerRunning():
+                    self.waitRequest(poller)
+            else:
+                #restarted after a crash: the sequencer is still running, so reattach with
+                #the headers and initial parameters it sent before instead of a handshake
+                paramHeader, resultHeader, lastExperiment = resume
+                self.paramHeader = paramHeader
+                self.resultHeader = resultHeader
+                self.paramHeaderReceived = True
+                self.resultHeaderReceived = True
+                self.learnerRunning()
+                self.sequencerRunning()
+                adapter = create_adapter(paramHeader, resultHeader, lastExperiment)
+                adapter.on_next = self.notify
+                self.onExpTaken = adapter.start
 
             #main rootin
             while True:
                 #Catch the latest experiment
-                if (not isNextExperimentReady) and self.isLastExpUnread():
+                if self.isLastExpUnread():
                     lastExperiment = self.getLastParam()
                     lastResult = self.getLastResult()
                     if adapter is None:
                         adapter = create_adapter(paramHeader, resultHeader, lastExperiment)
+                        adapter.on_next = self.notify
+                        self.onExpTaken = adapter.start
+                    elif adapter.write(lastExperiment, lastResult):
+                        numReceived += 1
+                        progress.publish(progress.RECEIVED, numReceived)
                     else:
-                        adapter.write(lastExperiment, lastResult)
-                    isNextExperimentReady = True
+                        #its slot was freed when the experiment expired
+                        _logger.info("Result of an expired experiment: %s", lastExperiment)
+
+                #experiments given up on after their timeout free their slots
+                expired = [] if adapter is None else adapter.pop_expired()
+                if expired:
+                    _logger.info("%d experiments expired", len(expired))
+                    numExpired += len(expired)
+                    progress.publish(progress.EXPIRED, numExpired)
 
                 #echo back
             #    if isNextExperimentReady and (not interface.isNextExpUnread()):
             #        interface.receiveNextExp(lastExperiment)
             #        isNextExperimentReady = False
-                #increment dammy index and put random parameters
-                if isNextExperimentReady and (not self.isNextExpUnread()) and adapter is not None:
+                #keep up to queueDepth experiments in flight
+                while adapter is not None and numDispatched - numReceived - numExpired < self.queueDepth:
+                    ready = adapter.ready
                     isLearnerRunning, nextExperiment = adapter.read()
-                    if not isLearnerRunning:
+                    if not isLearnerRunning or nextExperiment is None:
+                        if demandSince is None:
+                            demandSince = time.perf_counter()
                         break
-                    if nextExperiment is not None:
-                        self.receiveNextExp(nextExperiment)
-                        isNextExperimentReady = False
-
-                #handle the request from experimenter
-                self.solveRequest()
+                    if demandSince is not None:
+                        self.metrics.add('lookahead_wait', time.perf_counter() - demandSince)
+                        demandSince = None
+                    self.metrics.observe('lookahead', ready)
+                    self.receiveNextExp(nextExperiment)
+                    numDispatched += 1
+                    progress.publish(progress.DISPATCHED, numDispatched)
+                if not isLearnerRunning:
+                    break
+
+                #handle the request from experimenter; no CPU is spent while idle
+                self.waitRequest(poller)
 
             #interface.learnerStopped()
             #print "done"
         finally:
             if adapter is not None:
                 adapter.shutdown()
+            metrics.dump()
+            self.close()
+
+
+#commands accepted by solveTextRequest, keyed by method name
+PyLabInterface.commands = {
+    name: getattr(PyLabInterface, name) for name in [
+        'reInitialize',
+        'sequencerRunning',
+        'sequencerStopped',
+        'isSequencerRunning',
+        'learnerRunning',
+        'learnerStopped',
+        'isLearnerRunning',
+        'isHeaderInitialized',
+        'getParamHeader',
+        'getResultHeader',
+        'receiveParamHeaderAsStr',
+        'sendParamHeaderAsStr',
+        'receiveResultHeaderAsStr',
+        'sendResultHeaderAsStr',
+        'isLastExpUnread',
+        'getLastParam',
+        'getLastResult',
+        'receiveLastExpAsStr',
+        'isNextExpUnread',
+        'sendNextExpAsStr',
+        'sendNextExpsAsStr',
+        'ackExp',
+        'waitNextExp',
+        'exchangeAsStr',
+        'dumpMetrics',
+    ]
+}
+
+#commands accepted by solveBinaryRequest, keyed by the header token
+PyLabInterface.binaryCommands = {
+    'reInitialize': PyLabInterface.reInitialize,
+    'sequencerRunning': PyLabInterface.sequencerRunning,
+    'sequencerStopped': PyLabInterface.sequencerStopped,
+    'isSequencerRunning': PyLabInterface.isSequencerRunning,
+    'learnerRunning': PyLabInterface.learnerRunning,
+    'learnerStopped': PyLabInterface.learnerStopped,
+    'isLearnerRunning': PyLabInterface.isLearnerRunning,
+    'isHeaderInitialized': PyLabInterface.isHeaderInitialized,
+    'receiveParamHeader': lambda self, frame: self.receiveParamHeaderAsStr(frame.bytes.decode()),
+    'sendParamHeader': PyLabInterface.sendParamHeaderAsStr,
+    'receiveResultHeader': lambda self, frame: self.receiveResultHeaderAsStr(frame.bytes.decode()),
+    'sendResultHeader': PyLabInterface.sendResultHeaderAsStr,
+    'isLastExpUnread': PyLabInterface.isLastExpUnread,
+    'receiveLastExp': PyLabInterface.receiveLastExpAsBuffer,
+    'isNextExpUnread': PyLabInterface.isNextExpUnread,
+    'sendNextExp': PyLabInterface.sendNextExpAsBuffer,
+    'sendNextExps': PyLabInterface.sendNextExpsAsBuffer,
+    'ackExp': PyLabInterface.ackExpAsBuffer,
+    'waitNextExp': PyLabInterface.waitNextExpAsBuffer,
+    'exchange': PyLabInterface.exchangeAsBuffer,
+    'dumpMetrics': PyLabInterface.dumpMetrics,
+}
@@ -0,0 +1,147 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from logging import getLogger
+from threading import Thread
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import zmq
+
+from . import protocol
+from .adapter import Adapter
+from .pylabinterface import PyLabInterface
+
+
+_logger = getLogger(__name__)
+
+#reply to the requests of a sequencer whose PyLabInterface has finished or crashed
+_STOPPED = "Learner stopped."
+_FAILED = "Unknown error"
+
+
+class PyLabRouter(object):
+    #one ROUTER socket in front of one PyLabInterface thread per sequencer identity
+    def __init__(self, binder, create_adapter_factory: Callable[[bytes], Callable[[np.ndarray, np.ndarray, np.ndarray], Adapter]], queueDepth: int = 1) -> None:
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.ROUTER)
+        self.socket.bind(binder)
+        #each PyLabInterface thread says here why it finished: [identity, reply to its sequencer]
+        self.stopAddress = "inproc://pylabrouter-stop-%x" % id(self)
+        self.stopReceiver = self.context.socket(zmq.PULL)
+        self.stopReceiver.bind(self.stopAddress)
+        self.poller = zmq.Poller()
+        self.poller.register(self.socket, zmq.POLLIN)
+        self.poller.register(self.stopReceiver, zmq.POLLIN)
+        self.createAdapterFactory = create_adapter_factory
+        self.queueDepth = queueDepth
+        #per sequencer: DEALER connected to its own PyLabInterface, and the way back
+        self.backends: Dict[bytes, zmq.Socket] = {}
+        self.identities: Dict[zmq.Socket, bytes] = {}
+        self.threads: List[Thread] = []
+        #sequencers waiting for a reply, and whether they sent a binary request
+        self.waiting: Dict[bytes, bool] = {}
+        #sequencers whose PyLabInterface has finished, and what their requests get from now on
+        self.stopped: Dict[bytes, str] = {}
+
+    def connectBackend(self, identity):
+        binder = "inproc://pylabrouter-%x-%s" % (id(self), identity.hex())
+        thread = Thread(target=self.runBackend, args=(identity, binder), daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        backend = self.context.socket(zmq.DEALER)
+        backend.connect(binder)
+        self.poller.register(backend, zmq.POLLIN)
+        self.backends[identity] = backend
+        self.identities[backend] = identity
+        _logger.info("Sequencer %s connected.", identity.hex())
+        return backend
+
+    #body of a backend thread
+    def runBackend(self, identity, binder):
+        reply = _STOPPED
+        try:
+            PyLabInterface.run(binder, self.createAdapterFactory(identity), self.context, self.queueDepth)
+        except Exception:
+            _logger.exception("PyLabInterface of sequencer %s failed", identity.hex())
+            reply = _FAILED
+        finally:
+            stopSender = self.context.socket(zmq.PUSH)
+            stopSender.connect(self.stopAddress)
+            stopSender.send_multipart([identity, reply.encode()])
+            stopSender.close()
+
+    #the PyLabInterface of a sequencer finished: forget its backend and answer in its place
+    def dropBackend(self):
+        identity, reply = self.stopReceiver.recv_multipart()
+        backend = self.backends.pop(identity)
+        #replies sent before the thread finished are still to be forwarded
+        while backend.poll(0):
+            self.forwardReply(backend)
+        self.poller.unregister(backend)
+        del self.identities[backend]
+        backend.close(linger=0)
+        self.stopped[identity] = reply.decode()
+        _logger.info("Sequencer %s disconnected: %s", identity.hex(), self.stopped[identity])
+        if identity in self.waiting:
+            self.sendStopped(identity, self.waiting.pop(identity))
+
+    def sendStopped(self, identity, binary):
+        reply = self.stopped[identity]
+        self.socket.send_multipart([identity, b"", protocol.pack_header(reply) if binary else reply.encode()])
+
+    def forwardRequest(self):
+        #[identity, empty delimiter, *payload]; the REP behind the DEALER expects the delimiter
+        identity, *message = self.socket.recv_multipart(copy=False)
+        binary = protocol.is_binary(message[1])
+        if identity.bytes in self.stopped:
+            self.sendStopped(identity.bytes, binary)
+            return
+        backend = self.backends.get(identity.bytes)
+        if backend is None:
+            backend = self.connectBackend(identity.bytes)
+        self.waiting[identity.bytes] = binary
+        backend.send_multipart(message, copy=False)
+
+    def forwardReply(self, backend):
+        message = backend.recv_multipart(copy=False)
+        identity = self.identities[backend]
+        self.waiting.pop(identity, None)
+        self.socket.send_multipart([identity, *message], copy=False)
+
+    def close(self):
+        for backend in self.backends.values():
+            backend.close(linger=0)
+        self.stopReceiver.close()
+        self.socket.close()
+        #a PyLabInterface still running keeps its sockets open, and term() would wait for them
+        if not any(thread.is_alive() for thread in self.threads):
+            self.context.term()
+
+    #returns once every sequencer that connected has had its PyLabInterface finish
+    @classmethod
+    def run(cls, binder: Any, create_adapter_factory: Callable[[bytes], Callable[[np.ndarray, np.ndarray, np.ndarray], Adapter]], queueDepth: int = 1) -> None:
+        self = cls(binder, create_adapter_factory, queueDepth)
+        try:
+            while self.backends or not self.stopped:
+                for socket, _ in self.poller.poll():
+                    if socket is self.socket:
+                        self.forwardRequest()
+                    elif socket is self.stopReceiver:
+                        self.dropBackend()
+                    elif socket in self.identities:
+                        self.forwardReply(socket)
+        finally:
+            self.close()
@@ -0,0 +1,149 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Binary log of the sequencer protocol, for replaying a session later.
+#
+# The log is a sequence of records: RECORD (unix time, kind, number of
+# frames) followed by each frame as a FRAME length and its raw bytes. REQUEST
+# records hold the frames received from the sequencer, REPLY records the
+# frames sent back (a text reply is a single UTF-8 frame). The log starts with
+# an OPTIONS record, the server options as one JSON frame, so that a replay
+# can serve with the same queue depth, lookahead and timeout.
+
+
+import json
+import struct
+from threading import Lock
+import time
+from typing import Any, BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import zmq
+
+from src.pylabzmqinterface import protocol
+
+
+REQUEST = 0
+REPLY = 1
+OPTIONS = 2
+
+RECORD = struct.Struct('<dBI')
+FRAME = struct.Struct('<I')
+
+
+class Record(NamedTuple):
+    time: float
+    kind: int
+    frames: List[bytes]
+
+
+class Recorder:
+
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self._file: BinaryIO = open(path, 'wb')
+        # replies of long-poll commands may be sent from another code path than the request
+        self._lock = Lock()
+
+    def record(self, kind: int, frames: List[Any]) -> None:
+        frames = [*map(_to_bytes, frames)]
+        chunks = [RECORD.pack(time.time(), kind, len(frames))]
+        for frame in frames:
+            chunks += [FRAME.pack(len(frame)), frame]
+        with self._lock:
+            self._file.write(b''.join(chunks))
+            # keep the log usable even if the night ends with a crash
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+_recorder: Optional[Recorder] = None
+
+
+def open_log(path: str, options: Optional[Dict[str, Any]] = None) -> None:
+    global _recorder
+    _recorder = Recorder(path)
+    _recorder.record(OPTIONS, [json.dumps({} if options is None else options)])
+
+
+def record(kind: int, frames: List[Any]) -> None:
+    if _recorder is not None:
+        _recorder.record(kind, frames)
+
+
+def read(path: str) -> Iterator[Record]:
+    with open(path, 'rb') as file:
+        while True:
+            header = file.read(RECORD.size)
+            if len(header) < RECORD.size:
+                break
+            timestamp, kind, num_frames = RECORD.unpack(header)
+            frames = []
+            for _ in range(num_frames):
+                size, = FRAME.unpack(file.read(FRAME.size))
+                frames.append(file.read(size))
+            yield Record(timestamp, kind, frames)
+
+
+def get_exchanges(path: str) -> Iterator[Tuple[Record, Record]]:
+    request: Optional[Record] = None
+    for record in read(path):
+        if record.kind == REQUEST:
+            request = record
+        elif record.kind == REPLY and request is not None:
+            yield request, record
+            request = None
+
+
+# the options the recorded server ran with ({} for a log without them)
+def read_options(path: str) -> Dict[str, Any]:
+    for record in read(path):
+        if record.kind == OPTIONS:
+            return json.loads(record.frames[0])
+    return {}
+
+
+def replay(binder: Any, path: str, realtime: bool = False, context: Optional[zmq.Context] = None) -> pd.DataFrame:
+    socket = (zmq.Context.instance() if context is None else context).socket(zmq.REQ)
+    socket.connect(binder)
+    rows: List[Tuple[str, float, float]] = []
+    last_reply: Optional[Record] = None
+    last_reply_time = 0.0
+    try:
+        for request, reply in get_exchanges(path):
+            if realtime and last_reply is not None:
+                # keep the sequencer's own time between a reply and its next request
+                time.sleep(max(0.0, (request.time - last_reply.time) - (time.perf_counter() - last_reply_time)))
+            start = time.perf_counter()
+            socket.send_multipart(request.frames)
+            socket.recv_multipart()
+            last_reply, last_reply_time = reply, time.perf_counter()
+            rows.append((protocol.get_command(request.frames), reply.time - request.time, last_reply_time - start))
+    finally:
+        socket.close()
+    return pd.DataFrame(rows, columns=['command', 'recorded_latency', 'replayed_latency'])
+
+
+def _to_bytes(frame: Any) -> bytes:
+    if isinstance(frame, zmq.Frame):
+        return frame.bytes
+    if isinstance(frame, str):
+        return frame.encode()
+    if isinstance(frame, np.ndarray):
+        return frame.tobytes()
+    return bytes(frame)
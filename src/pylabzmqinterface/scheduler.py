@@ -0,0 +1,130 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Interleaving of independent campaigns on one sequencer.
+#
+# Every campaign (an Adaptee, usually a LearnerProcess) gets its own Adapter,
+# so one campaign can fit its model while the sequencer measures experiments
+# of another. The Scheduler has the interface of an Adapter: read() takes a
+# ready proposal from the campaigns in round robin, and write() routes a
+# result back to the campaign that proposed it, by scanNum when the parameter
+# header has it.
+
+
+import time
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.pylabzmqinterface.adaptee import Adaptee
+from src.pylabzmqinterface.adapter import Adapter
+from src.pylabzmqinterface.pending import Pending
+
+
+# campaign of an experiment and its number among those read, so that the entry of one
+# experiment can be told from that of another with the same parameters
+_Entry = Tuple[int, int]
+
+
+class Scheduler:
+
+    # outdirs: output directory of each campaign, for its idle table
+    def __init__(self, adaptees: Sequence[Adaptee], param_header: np.ndarray, lookahead: int = 1, expiry_interval: Optional[float] = None, outdirs: Optional[Sequence[str]] = None) -> None:
+        super().__init__()
+        # the rig waits only when no campaign has a proposal, so its idle time is tracked here
+        # and added to the campaign whose proposal ends the wait
+        self._adapters = [Adapter(adaptee, lookahead, expiry_interval, None if outdirs is None else outdirs[i], track_rig_idle=False) for i, adaptee in enumerate(adaptees)]
+        self._empty_since: Optional[float] = None
+        self._running = [True] * len(self._adapters)
+        # campaign of each experiment dispatched and without result yet, and of those of them
+        # the sequencer has not taken yet; an experiment has the same entry in both
+        self._lanes: Pending[_Entry] = Pending(param_header)
+        self._unstarted: Pending[_Entry] = Pending(param_header)
+        self._num_read = 0
+        # campaign of each experiment expired before its result came, until it comes
+        self._expired: Pending[int] = Pending(param_header)
+        self._next_lane = 0
+        self._on_next: Callable[[], None] = lambda: None
+
+    @property
+    def on_next(self) -> Callable[[], None]:
+        return self._on_next
+
+    @on_next.setter
+    def on_next(self, on_next: Callable[[], None]) -> None:
+        self._on_next = on_next
+        for adapter in self._adapters:
+            adapter.on_next = on_next
+
+    @property
+    def ready(self) -> int:
+        return sum(adapter.ready for adapter in self._adapters)
+
+    def pop_expired(self) -> List[np.ndarray]:
+        expired: List[np.ndarray] = []
+        for lane, adapter in enumerate(self._adapters):
+            for param in adapter.pop_expired():
+                entry = self._lanes.pop(param)
+                if entry is not None:
+                    self._unstarted.discard(param, entry)
+                self._expired.add(param, lane)
+                expired.append(param)
+        return expired
+
+    # returns whether the result frees a slot of the dispatch queue, as Adapter.write()
+    def write(self, last_param: np.ndarray, last_result: np.ndarray) -> bool:
+        entry = self._lanes.pop(last_param)
+        if entry is not None:
+            # a result may come before the sequencer is seen to take the experiment
+            self._unstarted.discard(last_param, entry)
+            return self._adapters[entry[0]].write(last_param, last_result)
+        lane = self._expired.pop(last_param)
+        if lane is not None:
+            self._adapters[lane].write(last_param, last_result)
+            return False
+        # proposed by no campaign, such as the NaN of a rig still filling its delay line
+        return True
+
+    def start(self, param: np.ndarray) -> None:
+        entry = self._unstarted.pop(param)
+        if entry is not None:
+            self._adapters[entry[0]].start(param)
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        now = time.perf_counter()
+        for i in range(len(self._adapters)):
+            lane = (self._next_lane + i) % len(self._adapters)
+            if not self._running[lane]:
+                continue
+            self._running[lane], next_param = self._adapters[lane].read()
+            if not self._running[lane]:
+                self._adapters[lane].shutdown()
+            elif next_param is not None:
+                entry = (lane, self._num_read)
+                self._num_read += 1
+                self._lanes.add(next_param, entry)
+                self._unstarted.add(next_param, entry)
+                self._next_lane = lane + 1
+                self._adapters[lane].add_rig_idle(0.0 if self._empty_since is None else now - self._empty_since)
+                self._empty_since = None
+                return True, next_param
+        if self._empty_since is None:
+            self._empty_since = now
+        return any(self._running), None
+
+    def shutdown(self) -> None:
+        for lane, adapter in enumerate(self._adapters):
+            if self._running[lane]:
+                adapter.shutdown()
@@ -13,41 +13,117 @@
 # limitations under the License.
 
 
-from copy import copy
-from typing import Callable, Generator, Iterator, List, Tuple
+from collections import deque
+from typing import Callable, Deque, Dict, Generator, Iterator, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 
 from src.common.genertools import call
-from src.common.math import allclose
 from src.pylabzmqinterface.adaptee import Adaptee
+from src.pylabzmqinterface.pending import Pending
+
+
+# what happens to an experiment without result after timeout seconds
+REDISPATCH = 'redispatch'  # send it to the sequencer again, up to max_redispatches times, then skip
+NAN = 'nan'                # give the learner a NaN result
+SKIP = 'skip'              # forget it; the learner proposes another one
+
+ON_TIMEOUTS = [REDISPATCH, NAN, SKIP]
+
+MAX_REDISPATCHES = 3
+
+# write_result of an experiment and how many times it was redispatched
+_Entry = Tuple[Callable[[pd.Series], None], int]
 
 
 class Session(Adaptee):
 
-    def __init__(self, on_session: Iterator[Generator[pd.Series, pd.Series, None]], param_header: np.ndarray, result_header: np.ndarray, initial_param: np.ndarray) -> None:
+    def __init__(self, on_session: Iterator[Generator[pd.Series, pd.Series, None]], param_header: np.ndarray, result_header: np.ndarray, initial_param: np.ndarray, timeout: Optional[float] = None, on_timeout: str = REDISPATCH, max_redispatches: int = MAX_REDISPATCHES) -> None:
+        if on_timeout not in ON_TIMEOUTS:
+            raise ValueError('on_timeout must be redispatch, nan or skip.')
         super().__init__()
         self._param_header = pd.Index(param_header)
         self._result_header = pd.Index(result_header)
-        self._initial_param = pd.Series(initial_param, index=self._param_header)
-        self._exps: List[Tuple[pd.Series, Callable[[pd.Series], None]]] = []
+        self._initial_param = np.array(initial_param, dtype=np.float64)
+        # positions of the learner's labels that are in the parameter header, and their positions there
+        self._positions: Dict[Tuple[str, ...], Tuple[np.ndarray, np.ndarray]] = {}
+        self._exps: Pending[_Entry] = Pending(param_header)
+        self._timeout = timeout
+        self._on_timeout = on_timeout
+        self._max_redispatches = max_redispatches
+        # dispatched but not yet taken by the sequencer, so without deadline yet
+        self._unstarted: Pending[_Entry] = Pending(param_header)
+        # in the order taken, so deadlines are sorted; entries may have got their result since
+        self._deadlines: Deque[Tuple[float, np.ndarray, _Entry]] = deque()
+        self._redispatches: Deque[Tuple[np.ndarray, _Entry]] = deque()
         self._on_session = on_session
 
-    def write(self, last_param: np.ndarray, last_result: np.ndarray) -> None:
-        for i, (param, write_result) in enumerate(self._exps):
-            if allclose(param.values, last_param):
-                self._exps.pop(i)
-                write_result(pd.Series(last_result, index=self._result_header))
-                break
+    @property
+    def num_pending(self) -> int:
+        return len(self._exps)
+
+    def write(self, last_param: np.ndarray, last_result: np.ndarray) -> bool:
+        entry = self._exps.pop(last_param)
+        if entry is None:
+            return False
+        self._unstarted.discard(last_param, entry)
+        write_result, _ = entry
+        write_result(pd.Series(last_result, index=self._result_header))
+        return True
+
+    def expire(self, now: float, param: Optional[np.ndarray] = None) -> List[np.ndarray]:
+        expired: List[Tuple[np.ndarray, _Entry]] = []
+        if param is not None:
+            entry = self._exps.pop(param)
+            if entry is not None:
+                self._unstarted.discard(param, entry)
+                expired.append((param, entry))
+        else:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, param, entry = self._deadlines.popleft()
+                if self._exps.discard(param, entry):
+                    expired.append((param, entry))
+        for param, (write_result, num_redispatches) in expired:
+            if self._on_timeout == REDISPATCH and num_redispatches < self._max_redispatches:
+                self._redispatches.append((param, (write_result, num_redispatches + 1)))
+            elif self._on_timeout == NAN:
+                write_result(pd.Series(np.nan, index=self._result_header))
+        return [param for param, _ in expired]
+
+    def start(self, param: np.ndarray, now: float) -> bool:
+        entry = self._unstarted.pop(param)
+        if entry is None:
+            return False
+        if self._timeout is not None:
+            self._deadlines.append((now + self._timeout, param, entry))
+        return True
 
     def create_reader(self) -> Iterator[np.ndarray]:
         last_param = self._initial_param
-        for on_experiment in self._on_session:
+        experiments = iter(self._on_session)
+        while True:
+            if self._redispatches:
+                yield self._dispatch(*self._redispatches.popleft())
+                continue
+            on_experiment = next(experiments, None)
+            if on_experiment is None:
+                break
             param, write_result = call(on_experiment)
-            last_param = copy(last_param)
-            for i in param.index:
-                if i in last_param.index:
-                    last_param[i] = param[i]
-            self._exps.append((last_param, write_result))
-            yield last_param.values
+            source, target = self._get_positions(param.index)
+            last_param = last_param.copy()
+            last_param[target] = param.values[source]
+            yield self._dispatch(last_param, (write_result, 0))
+
+    def _dispatch(self, param: np.ndarray, entry: _Entry) -> np.ndarray:
+        self._exps.add(param, entry)
+        self._unstarted.add(param, entry)
+        return param
+
+    def _get_positions(self, index: pd.Index) -> Tuple[np.ndarray, np.ndarray]:
+        key = tuple(index)
+        positions = self._positions.get(key)
+        if positions is None:
+            indexer = self._param_header.get_indexer(index)
+            positions = self._positions[key] = (np.flatnonzero(indexer >= 0), indexer[indexer >= 0])
+        return positions
@@ -0,0 +1,191 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Transport for a sequencer running on the same machine, through one shared
+# memory block instead of ZMQ and text encoding.
+#
+# The block starts with HEADER int64 fields, followed by two rings of
+# fixed-width float64 slots: parameters (learner -> sequencer, num_params
+# wide) and results (sequencer -> learner, the parameters followed by the
+# results). Each ring has one producer and one consumer; the producer fills a
+# slot and then increments its written counter, which is the doorbell the
+# consumer polls, and the consumer increments the taken counter when done.
+
+
+from collections import deque
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from threading import Event
+import os
+import time
+from typing import Callable, Deque, Optional, Set
+
+import numpy as np
+
+from src.pylabzmqinterface import progress, protocol
+from src.pylabzmqinterface.adapter import Adapter
+
+
+NUM_PARAMS, NUM_RESULTS, CAPACITY, CLOSED, PARAM_WRITTEN, PARAM_TAKEN, RESULT_WRITTEN, RESULT_TAKEN = range(8)
+
+HEADER_SIZE = 8
+
+# blocks created by this process
+_created: Set[str] = set()
+
+
+class Ring:
+
+    def __init__(self, header: np.ndarray, written: int, taken: int, slots: np.ndarray) -> None:
+        super().__init__()
+        self._header = header
+        self._written = written
+        self._taken = taken
+        self._slots = slots
+
+    def __len__(self) -> int:
+        return int(self._header[self._written] - self._header[self._taken])
+
+    def full(self) -> bool:
+        return len(self) >= len(self._slots)
+
+    def push(self, values: np.ndarray) -> bool:
+        if self.full():
+            return False
+        self._slots[self._header[self._written] % len(self._slots)] = values
+        self._header[self._written] += 1
+        return True
+
+    def pop(self) -> Optional[np.ndarray]:
+        if len(self) == 0:
+            return None
+        values = self._slots[self._header[self._taken] % len(self._slots)].copy()
+        self._header[self._taken] += 1
+        return values
+
+
+class Channel:
+
+    def __init__(self, memory: SharedMemory, owner: bool) -> None:
+        super().__init__()
+        self._memory = memory
+        self._owner = owner
+        self._header: np.ndarray = np.ndarray((HEADER_SIZE,), dtype=np.int64, buffer=memory.buf)
+        self.num_params = int(self._header[NUM_PARAMS])
+        self.num_results = int(self._header[NUM_RESULTS])
+        capacity = int(self._header[CAPACITY])
+        offset = self._header.nbytes
+        param_slots: np.ndarray = np.ndarray((capacity, self.num_params), dtype=protocol.FLOAT64, buffer=memory.buf, offset=offset)
+        offset += param_slots.nbytes
+        result_slots: np.ndarray = np.ndarray((capacity, self.num_params + self.num_results), dtype=protocol.FLOAT64, buffer=memory.buf, offset=offset)
+        self.params = Ring(self._header, PARAM_WRITTEN, PARAM_TAKEN, param_slots)
+        self.results = Ring(self._header, RESULT_WRITTEN, RESULT_TAKEN, result_slots)
+
+    @classmethod
+    def create(cls, name: str, num_params: int, num_results: int, capacity: int = 16) -> 'Channel':
+        size = 8 * HEADER_SIZE + protocol.FLOAT64.itemsize * capacity * (2 * num_params + num_results)
+        memory = SharedMemory(name, create=True, size=size)
+        _created.add(memory.name)
+        header: np.ndarray = np.ndarray((HEADER_SIZE,), dtype=np.int64, buffer=memory.buf)
+        header[:] = 0
+        header[[NUM_PARAMS, NUM_RESULTS, CAPACITY]] = num_params, num_results, capacity
+        del header
+        return cls(memory, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'Channel':
+        memory = SharedMemory(name)
+        # the creating process unlinks the block; without this the resource tracker of
+        # another process would unlink it too when that process exits
+        if memory.name not in _created:
+            resource_tracker.unregister(_tracked_name(memory), 'shared_memory')
+        return cls(memory, owner=False)
+
+    @property
+    def closed(self) -> bool:
+        return bool(self._header[CLOSED])
+
+    def close(self) -> None:
+        self._header[CLOSED] = 1
+
+    def release(self) -> None:
+        # the views must go before the block can be closed
+        del self.params, self.results, self._header
+        self._memory.close()
+        if self._owner:
+            self._memory.unlink()
+            _created.discard(self._memory.name)
+
+
+# the resource tracker knows a POSIX block by its name with the leading slash
+def _tracked_name(memory: SharedMemory) -> str:
+    return memory.name if os.name == 'nt' else '/' + memory.name
+
+
+# spin first for a microsecond hand-off, then give the CPU away with growing sleeps
+def wait(ready: Callable[[], bool], timeout: Optional[float] = None, spin: int = 1000, max_sleep: float = 1e-3) -> bool:
+    for _ in range(spin):
+        if ready():
+            return True
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = 1e-5
+    while not ready():
+        if deadline is not None and time.monotonic() > deadline:
+            return False
+        time.sleep(delay)
+        delay = min(max_sleep, 2 * delay)
+    return True
+
+
+# the learner runs in a thread of the serving process, so the server must not spin on the GIL
+def serve(channel: Channel, adapter: Adapter, queue_depth: int = 1, poll_interval: float = 1e-4) -> None:
+    woken = Event()
+    adapter.on_next = woken.set
+    num_dispatched = 0
+    num_received = 0
+    num_expired = 0
+    # pushed and not yet taken by the sequencer
+    pushed: Deque[np.ndarray] = deque()
+    try:
+        while True:
+            while len(pushed) > len(channel.params):
+                adapter.start(pushed.popleft())
+            while True:
+                values = channel.results.pop()
+                if values is None:
+                    break
+                if adapter.write(values[:channel.num_params], values[channel.num_params:]):
+                    num_received += 1
+                    progress.publish(progress.RECEIVED, num_received)
+            expired = adapter.pop_expired()
+            if expired:
+                num_expired += len(expired)
+                progress.publish(progress.EXPIRED, num_expired)
+            while num_dispatched - num_received - num_expired < queue_depth and not channel.params.full():
+                is_learner_running, param = adapter.read()
+                if not is_learner_running:
+                    return
+                if param is None:
+                    break
+                channel.params.push(param)
+                pushed.append(param)
+                num_dispatched += 1
+                progress.publish(progress.DISPATCHED, num_dispatched)
+            if len(channel.results) == 0:
+                woken.wait(poll_interval)
+            woken.clear()
+    finally:
+        channel.close()
+        adapter.shutdown()
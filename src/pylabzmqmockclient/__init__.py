@@ -13,15 +13,64 @@
 # limitations under the License.
 
 
-from typing import Any, Callable, Iterable
+import asyncio
+import time
+from typing import Any, Callable, Iterable, Optional
 
+import numpy as np
 import pandas as pd
 
+from src.pylabzmqinterface.sharedmemory import Channel, wait
+
+from src.pylabzmqmockclient.asyncclient import AsyncPyLabClient, Throughput, to_async
 from src.pylabzmqmockclient.pylabclient import PyLabClient
 from src.pylabzmqmockclient.experiment import Experiment
 
 
-def run(binder: Any, param_header: Iterable[str], result_header: Iterable[str], simulate: Callable[[pd.Series], pd.Series], delay_size: int) -> None:
+def run(binder: Any, param_header: Iterable[str], result_header: Iterable[str], simulate: Callable[[pd.Series], pd.Series], delay_size: int, binary: bool = False, long_poll_timeout: float = 0.0, exchange: bool = False, queue_depth: int = 0) -> None:
+    _param_header = pd.Index([*param_header])
+    _result_header = pd.Index([*result_header])
+    PyLabClient.run(binder, _param_header.values, _result_header.values, Experiment(_param_header, _result_header, simulate, delay_size), binary=binary, longPollTimeout=long_poll_timeout, exchange=exchange, queueDepth=queue_depth)
+
+
+def run_async(binder: Any, param_header: Iterable[str], result_header: Iterable[str], simulate: Callable[[pd.Series], pd.Series], delay_size: int, long_poll_timeout: float = 1.0, queue_depth: int = 0, num_experiments: Optional[int] = None) -> Throughput:
+    _param_header = pd.Index([*param_header])
+    _result_header = pd.Index([*result_header])
+    experiment = to_async(Experiment(_param_header, _result_header, simulate, delay_size))
+
+    async def run_client() -> Throughput:
+        client = AsyncPyLabClient(binder, [*_param_header], [*_result_header], long_poll_timeout=long_poll_timeout)
+        if queue_depth > 0:
+            return await client.run_pipelined(experiment, queue_depth, num_experiments)
+        return await client.run(experiment, num_experiments)
+
+    throughput = asyncio.run(run_client())
+    print(throughput)
+    return throughput
+
+
+def run_shared_memory(name: str, param_header: Iterable[str], result_header: Iterable[str], simulate: Callable[[pd.Series], pd.Series], delay_size: int) -> int:
     _param_header = pd.Index([*param_header])
     _result_header = pd.Index([*result_header])
-    PyLabClient.run(binder, _param_header.values, _result_header.values, Experiment(_param_header, _result_header, simulate, delay_size))
+    experiment = Experiment(_param_header, _result_header, simulate, delay_size)
+    while True:
+        try:
+            channel = Channel.attach(name)
+            break
+        except FileNotFoundError:
+            time.sleep(0.1)
+    counter = 0
+    try:
+        while True:
+            wait(lambda: len(channel.params) > 0 or channel.closed)
+            next_param = channel.params.pop()
+            if next_param is None:
+                break
+            last_param, last_result = experiment(next_param)
+            wait(lambda: not channel.results.full())
+            channel.results.push(np.concatenate([last_param, last_result]))
+            counter += 1
+    finally:
+        channel.release()
+    print("%d experiments were done." % counter)
+    return counter
@@ -0,0 +1,189 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+from collections import deque
+import json
+import time
+from typing import Any, Awaitable, Callable, Deque, List, Optional, Tuple
+
+import numpy as np
+import zmq
+import zmq.asyncio
+
+from src.pylabzmqinterface import codec, protocol
+
+
+AsyncExperiment = Callable[[np.ndarray], Awaitable[Tuple[np.ndarray, np.ndarray]]]
+
+
+def to_async(experiment: Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]]) -> AsyncExperiment:
+
+    async def wrapper(param: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return await asyncio.get_running_loop().run_in_executor(None, experiment, param)
+
+    return wrapper
+
+
+class Throughput:
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.start = time.perf_counter()
+        self.num_experiments = 0
+        self.num_requests = 0
+        self.latencies: List[float] = []
+        self.num_empty_polls = 0
+        self.experiment_time = 0.0
+        self.waiting_time = 0.0
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    @property
+    def rate(self) -> float:
+        return self.num_experiments / self.elapsed
+
+    def __str__(self) -> str:
+        return (
+            f'{self.num_experiments} experiments in {self.elapsed:.3f} s ({self.rate:.1f}/s), '
+            f'{self.num_requests} requests, {self.num_empty_polls} empty polls, '
+            f'{self.experiment_time:.3f} s experimenting, {self.waiting_time:.3f} s waiting for the learner'
+        )
+
+
+class Backoff:
+
+    def __init__(self, minimum: float, maximum: float) -> None:
+        super().__init__()
+        self._minimum = minimum
+        self._maximum = maximum
+        self._delay = 0.0
+
+    async def wait(self) -> None:
+        self._delay = min(self._maximum, max(self._minimum, 2 * self._delay))
+        await asyncio.sleep(self._delay)
+
+    def reset(self) -> None:
+        self._delay = 0.0
+
+
+class AsyncPyLabClient:
+
+    def __init__(self, binder: Any, param_header: List[str], result_header: List[str], long_poll_timeout: float = 1.0, min_backoff: float = 0.001, max_backoff: float = 0.2, context: Optional[zmq.asyncio.Context] = None) -> None:
+        super().__init__()
+        # shadow the process-wide context, so that an inproc server in the same process can be reached
+        self._context = zmq.asyncio.Context.shadow(zmq.Context.instance().underlying) if context is None else context
+        self._socket = self._context.socket(zmq.REQ)
+        self._socket.connect(binder)
+        self._param_header = [*param_header]
+        self._result_header = [*result_header]
+        self._long_poll_timeout = long_poll_timeout
+        self._backoff = Backoff(min_backoff, max_backoff)
+        # a REQ socket has at most one request in flight
+        self._lock = asyncio.Lock()
+        self.throughput = Throughput()
+
+    async def request(self, message: str) -> Any:
+        async with self._lock:
+            start = time.perf_counter()
+            await self._socket.send_string(message)
+            reply = await self._socket.recv_string()
+            self.throughput.latencies.append(time.perf_counter() - start)
+        self.throughput.num_requests += 1
+        try:
+            return json.loads(reply)
+        except ValueError:
+            raise RuntimeError(f'{message}: {reply}')
+
+    async def connect(self) -> None:
+        await self.request('sequencerStopped()')
+        if not await self.request('isHeaderInitialized()'):
+            await self.request('receiveParamHeaderAsStr("%s")' % codec.SEPARATOR.join(self._param_header))
+            await self.request('receiveResultHeaderAsStr("%s")' % codec.SEPARATOR.join(self._result_header))
+        while not await self.request('isLearnerRunning()'):
+            await self._backoff.wait()
+        self._backoff.reset()
+        await self.request('sequencerRunning()')
+
+    async def run(self, experiment: AsyncExperiment, num_experiments: Optional[int] = None) -> Throughput:
+        await self.connect()
+        # count from the first experiment, not from the (polling) start-up
+        self.throughput = Throughput()
+        # the initial (dummy) experiment starts the learner
+        next_param = await self._exchange(np.zeros(len(self._param_header)), np.zeros(len(self._result_header)))
+        while num_experiments is None or self.throughput.num_experiments < num_experiments:
+            param, result = await self._experiment(experiment, next_param)
+            next_param = await self._exchange(param, result)
+        return self.throughput
+
+    async def run_pipelined(self, experiment: AsyncExperiment, queue_depth: int, num_experiments: Optional[int] = None) -> Throughput:
+        await self.connect()
+        # count from the first experiment, not from the (polling) start-up
+        self.throughput = Throughput()
+        await self._post(np.zeros(len(self._param_header)), np.zeros(len(self._result_header)))
+        queued: Deque[np.ndarray] = deque()
+        posting: Optional[asyncio.Future] = None
+        while num_experiments is None or self.throughput.num_experiments < num_experiments:
+            if not queued:
+                # the learner may need the result still being posted
+                if posting is not None:
+                    await posting
+                    posting = None
+                queued.extend(await self._fetch(queue_depth))
+            param, result = await self._experiment(experiment, queued.popleft())
+            # post the result while the next queued experiment runs
+            if posting is not None:
+                await posting
+            posting = asyncio.ensure_future(self._post(param, result))
+        if posting is not None:
+            await posting
+        return self.throughput
+
+    async def _experiment(self, experiment: AsyncExperiment, param: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        start = time.perf_counter()
+        param, result = await experiment(param)
+        self.throughput.experiment_time += time.perf_counter() - start
+        self.throughput.num_experiments += 1
+        return param, result
+
+    async def _exchange(self, param: np.ndarray, result: np.ndarray) -> np.ndarray:
+        start = time.perf_counter()
+        reply = await self.request('exchangeAsStr("%s", "%s", %r)' % (codec.format_array(param, codec.SHORTEST), codec.format_array(result, codec.SHORTEST), self._long_poll_timeout))
+        while reply == protocol.PENDING:
+            self.throughput.num_empty_polls += 1
+            # a long-poll already waited on the server side
+            if self._long_poll_timeout <= 0:
+                await self._backoff.wait()
+            reply = await self.request('waitNextExp(%r)' % self._long_poll_timeout)
+        self._backoff.reset()
+        self.throughput.waiting_time += time.perf_counter() - start
+        return codec.parse_array(reply)
+
+    async def _post(self, param: np.ndarray, result: np.ndarray) -> None:
+        await self.request('receiveLastExpAsStr("%s", "%s")' % (codec.format_array(param, codec.SHORTEST), codec.format_array(result, codec.SHORTEST)))
+
+    async def _fetch(self, queue_depth: int) -> List[np.ndarray]:
+        start = time.perf_counter()
+        exps = await self.request('sendNextExpsAsStr(%d)' % queue_depth)
+        while not exps:
+            self.throughput.num_empty_polls += 1
+            await self._backoff.wait()
+            exps = await self.request('sendNextExpsAsStr(%d)' % queue_depth)
+        self._backoff.reset()
+        await self.request('ackExp(%s)' % ', '.join(str(ticket) for ticket, _ in exps))
+        self.throughput.waiting_time += time.perf_counter() - start
+        return [codec.parse_array(param) for _, param in exps]
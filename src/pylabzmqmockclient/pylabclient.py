@@ -13,12 +13,15 @@
 # limitations under the License.
 
 
+import json
 import time
-from typing import Any, Callable, Tuple
+from typing import Any, Callable, List, Tuple
 
 import numpy as np
 import zmq
 
+from src.pylabzmqinterface import codec, protocol
+
 
 def str2Bool(recvStr):
     if recvStr.find("true") != -1:
@@ -29,8 +32,8 @@ def str2Bool(recvStr):
 
 class PyLabClient(object):
     def __init__(self, binder: Any, paramHeader: np.ndarray, resultHeader: np.ndarray) -> None:
-        #zeroMQ socket client
-        self.context = zmq.Context()
+        #zeroMQ socket client (process-wide context, shared with an inproc server)
+        self.context: zmq.Context = zmq.Context.instance()
         self.socket = self.context.socket(zmq.REQ)
         self.socket.connect(binder)
 
@@ -46,6 +49,8 @@ class PyLabClient(object):
         #Next parameters from learner
         self.nextExpParam = np.array([0], dtype = float)
         self.nextExpReceived = False
+        #experiments taken over from the dispatch queue as (ticket, parameters), waiting to be done
+        self.queuedExps: List[Tuple[Any, Any]] = []
         #counter
         self.counter = 0
         
@@ -107,30 +112,46 @@ class PyLabClient(object):
         self.lastExpReady = False
         return sendStr
     
+    #binary (multipart) request: header frame with command name, then raw float64 frames
+    def requestBinary(self, command, *frames):
+        self.socket.send_multipart([protocol.pack_header(command), *frames], copy=False)
+        return self.socket.recv_multipart(copy=False)
+
+    #fetch up to queueDepth experiments and acknowledge them, so that they are not sent again
+    def receiveNextExpsAsStr(self, queueDepth):
+        self.socket.send_string("sendNextExpsAsStr(%d)" % queueDepth)
+        self.queuedExps = json.loads(self.socket.recv_string())
+        if self.queuedExps:
+            self.socket.send_string("ackExp(%s)" % ", ".join(str(ticket) for ticket, _ in self.queuedExps))
+            print("Acknowledged experiments: " + self.socket.recv_string())
+
+    def receiveNextExpsAsBuffer(self, queueDepth):
+        reply = self.requestBinary("sendNextExps", protocol.pack_array(np.array([queueDepth])))
+        tickets = protocol.unpack_array(reply[1])
+        self.queuedExps = list(zip(tickets, reply[2:]))
+        if self.queuedExps:
+            print("Acknowledged experiments: " + protocol.unpack_header(self.requestBinary("ackExp", protocol.pack_array(tickets))[0]))
+
+    def sendLastExpAsBuffer(self):
+        self.lastExpReady = False
+        return protocol.pack_array(self.lastExpParam), protocol.pack_array(self.lastExpResult)
+
+    def receiveNextExpAsBuffer(self, frame):
+        self.nextExpReceived = True
+        self.nextExpParam = protocol.unpack_array(frame)
+        print(self.nextExpParam)
+
     @staticmethod
     def npArray2Str(npArray):
-        npAsStr = ""
-        for num in npArray:
-            npAsStr += str(num)
-            npAsStr += "\t"
-        return npAsStr.rstrip("\t")
+        return codec.format_array(npArray, codec.SHORTEST)
     
-    #slice the camma separated array str into nparray
+    #slice the tab separated array str (still escaped as in the json reply) into nparray
     @staticmethod
     def str2NParray(arrayStr):
-        #print arrayStr.split(",")
-        list = []
-        for valStr in arrayStr.lstrip("\"").rstrip("\"").split("\\t"):
-            try:
-                valNum = float(valStr)
-            except:
-                valNum = float("NaN")
-            list.append(valNum)
-        npArray = np.array(list)
-        return npArray
+        return codec.parse_array(arrayStr.lstrip("\"").rstrip("\""), "\\t")
 
     @classmethod
-    def run(cls, binder: Any, paramHeader: np.ndarray, resultHeader: np.ndarray, experiment: Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]], WAITTIME: float = 0.2) -> None:
+    def run(cls, binder: Any, paramHeader: np.ndarray, resultHeader: np.ndarray, experiment: Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]], WAITTIME: float = 0.2, binary: bool = False, longPollTimeout: float = 0.0, exchange: bool = False, queueDepth: int = 0) -> None:
 
         # Socket to talk to PyLabZMQ server
         print("connecting to PyLabZMQ server")
@@ -185,30 +206,95 @@ class PyLabClient(object):
 
             ##Main rootin
             while True:
-                #send latest result and experimental parameters
-                if self.lastExpReady:
-                    self.socket.send_string("isLastExpUnread()")
-                    lastExpUnread = str2Bool(self.socket.recv_string())
-                    if not lastExpUnread:
-                        sendStr = "receiveLastExpAsStr(\"%s\")" % self.sendLastExpAsStr()
+                if queueDepth > 0:
+                    #pipelined: run the queued experiments back to back while the learner works on the next ones
+                    if self.lastExpReady:
+                        if binary:
+                            self.requestBinary("receiveLastExp", *self.sendLastExpAsBuffer())
+                        else:
+                            self.socket.send_string("receiveLastExpAsStr(\"%s\")" % self.sendLastExpAsStr())
+                            print("Last parameters to learner: " + self.socket.recv_string())
+
+                    if not self.nextExpReceived:
+                        if not self.queuedExps:
+                            if binary:
+                                self.receiveNextExpsAsBuffer(queueDepth)
+                            else:
+                                self.receiveNextExpsAsStr(queueDepth)
+                        if self.queuedExps:
+                            _, nextExp = self.queuedExps.pop(0)
+                            if binary:
+                                self.receiveNextExpAsBuffer(nextExp)
+                            else:
+                                #back to the form sendNextExpAsStr replies with
+                                self.receiveNextExpAsStr(json.dumps(nextExp))
+
+                elif binary:
+                    #same exchange as below over multipart frames, without text encoding
+                    if self.lastExpReady and exchange:
+                        reply = self.requestBinary("exchange", *self.sendLastExpAsBuffer(), protocol.pack_array(np.array([longPollTimeout])))
+                        if len(reply) > 1:
+                            self.receiveNextExpAsBuffer(reply[1])
+
+                    elif self.lastExpReady:
+                        lastExpUnread = str2Bool(protocol.unpack_header(self.requestBinary("isLastExpUnread")[0]))
+                        if not lastExpUnread:
+                            self.requestBinary("receiveLastExp", *self.sendLastExpAsBuffer())
+
+                    if not self.nextExpReceived:
+                        if longPollTimeout > 0:
+                            reply = self.requestBinary("waitNextExp", protocol.pack_array(np.array([longPollTimeout])))
+                            if len(reply) > 1:
+                                self.receiveNextExpAsBuffer(reply[1])
+                        else:
+                            nextExpUnread = str2Bool(protocol.unpack_header(self.requestBinary("isNextExpUnread")[0]))
+                            if nextExpUnread:
+                                self.receiveNextExpAsBuffer(self.requestBinary("sendNextExp")[1])
+
+                else:
+                    #send latest result and get next parameters in one round trip
+                    if self.lastExpReady and exchange:
+                        sendStr = "exchangeAsStr(\"%s\", %r)" % (self.sendLastExpAsStr(), longPollTimeout)
                         self.socket.send_string(sendStr)
-                        print("Last parameters to learner: " + self.socket.recv_string())
+                        recvStr = self.socket.recv_string()
+                        if recvStr != json.dumps(protocol.PENDING):
+                            print("Next paramters from leaner: " + recvStr)
+                            self.receiveNextExpAsStr(recvStr)
 
-                #get new experimental parameters and do experiment
-                if not self.nextExpReceived:
-                    self.socket.send_string("isNextExpUnread()")
-                    nextExpUnread = str2Bool(self.socket.recv_string())
+                    #send latest result and experimental parameters
+                    elif self.lastExpReady:
+                        self.socket.send_string("isLastExpUnread()")
+                        lastExpUnread = str2Bool(self.socket.recv_string())
+                        if not lastExpUnread:
+                            sendStr = "receiveLastExpAsStr(\"%s\")" % self.sendLastExpAsStr()
+                            self.socket.send_string(sendStr)
+                            print("Last parameters to learner: " + self.socket.recv_string())
 
-                    if nextExpUnread:
-                        self.socket.send_string("sendNextExpAsStr()")
+                    #get new experimental parameters and do experiment
+                    if not self.nextExpReceived and longPollTimeout > 0:
+                        #server holds the request until the parameters are ready or the timeout passes
+                        self.socket.send_string("waitNextExp(%r)" % longPollTimeout)
                         recvStr = self.socket.recv_string()
-                        print("Next paramters from leaner: " + recvStr)
-                        self.receiveNextExpAsStr(recvStr)
+                        if recvStr != json.dumps(protocol.PENDING):
+                            print("Next paramters from leaner: " + recvStr)
+                            self.receiveNextExpAsStr(recvStr)
+
+                    elif not self.nextExpReceived:
+                        self.socket.send_string("isNextExpUnread()")
+                        nextExpUnread = str2Bool(self.socket.recv_string())
+
+                        if nextExpUnread:
+                            self.socket.send_string("sendNextExpAsStr()")
+                            recvStr = self.socket.recv_string()
+                            print("Next paramters from leaner: " + recvStr)
+                            self.receiveNextExpAsStr(recvStr)
 
                 if self.isDammyExperimentReady():
                     self.doDammyExperiment(experiment)
 
-                time.sleep(WAITTIME)
+                #long-poll already waited on the server side, and queued experiments need no wait
+                if longPollTimeout <= 0 and not self.queuedExps:
+                    time.sleep(WAITTIME)
 
         finally:
             pass
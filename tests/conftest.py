@@ -0,0 +1,24 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+
+import os
+import tempfile
+
+
+# importing src makes its output directory under the working directory unless
+# src.pylabzmqinterface.learnerprocess.OUTDIR_ENV names one; it must be set before that import
+os.environ.setdefault('PYLABZMQ_OUTDIR', tempfile.mkdtemp(prefix='pylabzmq-tests-'))
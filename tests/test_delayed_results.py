@@ -0,0 +1,73 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+
+from threading import Thread
+from typing import Iterator, List, Generator, Tuple
+
+import pandas as pd
+
+from src import pylabzmqinterface, pylabzmqmockclient
+
+
+PARAM_HEADER = ['Labview Param T', 'Labview Param 1']
+RESULT_HEADER = ['Labview Result']
+
+
+def simulate(param: pd.Series) -> pd.Series:
+    return pd.Series([param.values.sum()], index=RESULT_HEADER)
+
+
+def create_on_connection(results: List[Tuple[float, float]], num_experiments: int) -> Iterator[Iterator[Generator[pd.Series, pd.Series, None]]]:
+
+    def on_session() -> Iterator[Generator[pd.Series, pd.Series, None]]:
+        for k in range(num_experiments):
+
+            def experiment(k: int = k) -> Generator[pd.Series, pd.Series, None]:
+                result = yield pd.Series([k, 0.1 * k], index=PARAM_HEADER)
+                results.append((k, float(result.iloc[0])))
+
+            yield experiment()
+
+    yield on_session()
+
+
+# the mock rig returns every result delay_size experiments late, so its first results are NaN
+# of no experiment; they must free their slots all the same or the dispatch queue stalls
+def test_run_with_delayed_results() -> None:
+    results: List[Tuple[float, float]] = []
+    binder = 'inproc://test-run-with-delayed-results'
+    Thread(target=pylabzmqmockclient.run, args=(binder, PARAM_HEADER, RESULT_HEADER, simulate, 2), kwargs={'long_poll_timeout': 1.0, 'exchange': True}, daemon=True).start()
+    server = Thread(target=pylabzmqinterface.run, args=(binder, create_on_connection(results, 6)), daemon=True)
+    server.start()
+    server.join(30)
+    assert not server.is_alive()
+    # the last experiments stay in the delay line when the learner runs out of proposals
+    assert [k for k, _ in results] == [*range(len(results))] and len(results) >= 3
+    assert all(abs(result - 1.1 * k) < 1e-9 for k, result in results)
+
+
+def test_run_shared_memory_with_delayed_results() -> None:
+    results: List[Tuple[float, float]] = []
+    name = 'test_delayed_%d' % id(results)
+    Thread(target=pylabzmqmockclient.run_shared_memory, args=(name, PARAM_HEADER, RESULT_HEADER, simulate, 2), daemon=True).start()
+    server = Thread(target=pylabzmqinterface.run_shared_memory, args=(name, create_on_connection(results, 6), PARAM_HEADER, RESULT_HEADER), daemon=True)
+    server.start()
+    server.join(30)
+    assert not server.is_alive()
+    # the last experiments stay in the delay line when the learner runs out of proposals
+    assert [k for k, _ in results] == [*range(len(results))] and len(results) >= 3
+    assert all(abs(result - 1.1 * k) < 1e-9 for k, result in results)
@@ -0,0 +1,37 @@
+# Copyright 2019 AIST
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+
+import math
+
+from src.pylabzmqinterface.metrics import NUM_BUCKETS, Histogram
+
+
+# bucket k counts the durations in (2**(k-1), 2**k] us, the first one also the shorter ones
+def test_histogram_bucket_upper_edges_are_inclusive() -> None:
+    for k in range(NUM_BUCKETS - 1):
+        for us, bucket in [(2 ** k, k), (math.nextafter(2 ** k, math.inf), k + 1), (math.nextafter(2 ** k, 0), k)]:
+            histogram = Histogram()
+            histogram.add(us / 1e6)
+            assert histogram.counts[min(bucket, NUM_BUCKETS - 1)] == 1, (us, bucket)
+
+
+def test_histogram_clamps_to_first_and_last_buckets() -> None:
+    histogram = Histogram()
+    for seconds in [0.0, 1e-9, 0.5e-6, 2 ** (NUM_BUCKETS - 2) / 1e6 * 1.5, 1e3]:
+        histogram.add(seconds)
+    assert histogram.counts[0] == 3
+    assert histogram.counts[NUM_BUCKETS - 1] == 2